@@ -2,14 +2,10 @@
 # utility functions for working with excerpts coded in dedoose and exported to flat files
 # version 1.1
 
+import numpy as np
 import pandas as pd
 import re
 
-'''Yes, ignoring warnings is bad, but the apply function in drop_uncoded
-works reliably despite this warning (which only appears in some environments).
-'''
-pd.options.mode.chained_assignment = None
-
 def col_merge(row, cols, fill_na=''):
     '''Sometimes Dedoose doesn't recognise that descriptor columns 
     from different imports are the same. This applyable function 
@@ -23,6 +19,24 @@ def col_merge(row, cols, fill_na=''):
             return row[c]
     return fill_na
 
+def merge_cols(df, cols, fill_na=''):
+    '''Column-wise version of col_merge(): for each row, the first 
+    non-null value among cols, or fill_na if they are all null. Same 
+    result as df.apply(col_merge, cols=cols, fill_na=fill_na, axis=1).
+    '''
+    values = df[list(cols)].to_numpy(dtype=object)
+    found = pd.notnull(values)
+    
+    if values.shape[1] == 0:
+        result = np.full(df.shape[0], fill_na, dtype=object)
+    else:
+        #position of the first non-null value in each row
+        first = found.argmax(axis=1)
+        result = values[np.arange(df.shape[0]), first]
+        result = np.where(found.any(axis=1), result, fill_na)
+    
+    return pd.Series(result, index=df.index).infer_objects()
+
 def clean_col_names(df):
     '''Dedoose column names are clumsy, like titling code applications 
     'Code: xxx Applied' and naming the start index of an excerpt 'Package'.
@@ -47,15 +61,121 @@ def drop_uncoded(df, code_cols, inverse=False):
     function keeps just the ones that are relevant to our analysis.
     '''
     #Flag whether this excerpt has been coded with any of the codes we care about.
-    df['xxcodedxx'] = df.apply(check_codes, cols=code_cols, axis=1)
+    coded = df[list(code_cols)].astype(bool).any(axis=1)
         
     if inverse:
         #Drop all excerpts with codes we care about
-        df = df[df['xxcodedxx'] == False]
+        return df[~coded]
+    
+    #Drop excerpts without any codes we care about
+    return df[coded]
+
+def read_excerpts(path, code_cols, keep_cols=None, chunksize=50000, 
+                  sep='\t', drop=True, inverse=False):
+    '''Read a large Dedoose export (or any of our TSV files) in chunks, 
+    so peak memory is one chunk rather than the whole file. Each chunk 
+    gets clean_col_names(), column selection and drop_uncoded() before 
+    it is yielded, and code columns (booleans or counts) become booleans. 
+    Only flat files can be read in chunks; convert .xlsx exports first.
+    Input:
+        path: the file to read
+        code_cols: the (clean) names of the code columns we care about
+        keep_cols: other (clean) columns to keep. Defaults to all of them.
+        Leaving out large text columns like 'Excerpt Copy' saves the most.
+        chunksize: number of rows per chunk
+        drop: whether to drop excerpts without any of code_cols 
+        inverse: passed to drop_uncoded()
+    Yields data frames that can be analyzed one at a time, or fed to an
+    accumulator, e.g.:
+        acc = network_utils.CooccurAccumulator(code_cols)
+        acc.update(c[code_cols] for c in read_excerpts(path, code_cols))
+    '''
+    #map clean names back to the raw ones using only the header
+    header = pd.read_csv(path, sep=sep, nrows=0).columns
+    clean = clean_col_names(pd.DataFrame(columns=header)).columns
+    raw_name = dict(zip(clean, header))
+    
+    if keep_cols is None:
+        keep_cols = [c for c in clean if c not in code_cols]
+    cols = list(keep_cols) + list(code_cols)
+    
+    #code columns may hold booleans or counts, with blanks, so they are
+    #left for read_csv to infer and converted per chunk
+    reader = pd.read_csv(path, sep=sep, chunksize=chunksize, 
+                         usecols=[raw_name[c] for c in cols])
+    
+    for chunk in reader:
+        chunk = clean_col_names(chunk)[cols]
+        #a blank code cell means the code was not applied
+        chunk[code_cols] = chunk[code_cols].fillna(False).astype(bool)
+        if drop:
+            chunk = drop_uncoded(chunk, code_cols, inverse=inverse)
+        yield chunk
+
+def save_frame(df, path, code_cols=None, compact=False):
+    '''Save cleaned excerpts, merged codings or similarity edge lists in
+    a columnar binary format, so later steps don't re-parse text files.
+    Paths ending in .parquet are written as Parquet, anything else as 
+    uncompressed Feather (Arrow), which load_frame() can memory map. 
+    Needs pyarrow.
+    Input:
+        code_cols: columns to store as booleans, which Arrow packs into 
+        one bit per value
+        compact: downcast integer columns to the smallest type that fits
+        them and floats to float32, e.g. for edge lists
+    '''
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    
+    if code_cols is not None:
+        df = df.astype(dict((c, bool) for c in code_cols))
+    if compact:
+        df = df.copy()
+        for c in df.columns:
+            if pd.api.types.is_bool_dtype(df[c]):
+                continue
+            if pd.api.types.is_integer_dtype(df[c]):
+                df[c] = pd.to_numeric(df[c], downcast='integer')
+            elif pd.api.types.is_float_dtype(df[c]):
+                df[c] = df[c].astype(np.float32)
+    
+    #a default RangeIndex is kept as metadata rather than a column
+    table = pa.Table.from_pandas(df, preserve_index=None)
+    if str(path).endswith('.parquet'):
+        pq.write_table(table, path)
     else:
-        #Drop excerpts without any codes we care about
-        df = df[df['xxcodedxx']]
+        feather.write_feather(table, path, compression='uncompressed')
+
+def load_frame(path, columns=None, memory_map=True):
+    '''Load a data frame written by save_frame() (or any Feather or 
+    Parquet file), with its index. 
+    Input:
+        columns: only read these columns
+        memory_map: map the file instead of reading it into memory 
+        first, where the format allows
+    '''
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    
+    if str(path).endswith('.parquet'):
+        schema = pq.read_schema(path)
+    else:
+        #mapping the whole file costs nothing until columns are used
+        table = feather.read_table(path, memory_map=memory_map)
+        schema = table.schema
+    
+    if columns is not None:
+        #always read the index columns too. Files written without 
+        #pandas (e.g. by jaccard_to_file()) have none.
+        meta = schema.pandas_metadata or {'index_columns': []}
+        index_cols = [c for c in meta['index_columns'] 
+                      if isinstance(c, str)]
+        columns = index_cols + [c for c in columns if c not in index_cols]
     
-    #Drop our temporary column
-    return df.drop('xxcodedxx', axis=1)
+    if str(path).endswith('.parquet'):
+        table = pq.read_table(path, columns=columns, memory_map=memory_map)
+    elif columns is not None:
+        table = table.select(columns)
     
+    return table.to_pandas()
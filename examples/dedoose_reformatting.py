@@ -27,7 +27,7 @@ print('Found', raw.shape[0], 'excerpts.')
 print('Merging school columns...')
 school_cols = ['school', 'school.1', 'school.2', 'school.3',
               'school.4', 'school.5',]
-raw['uni'] = raw.apply(col_merge, cols=school_cols, fill_na='fsu', axis=1)
+raw['uni'] = merge_cols(raw, school_cols, fill_na='fsu')
 
 print('Merging identity columns...')
 cols = raw.columns.values
@@ -41,7 +41,7 @@ for a in to_merge:
     #select all columns matching the set
     these_cols = [m.group(0) for l in cols for m in [regex.search(l)] if m]
     print('Merging', these_cols, "...")
-    raw[a] = raw.apply(col_merge, cols=these_cols, axis=1)
+    raw[a] = merge_cols(raw, these_cols)
 
 print('Identifying SGMs and CisHets...')
 def find_ident(row, q_cols):
@@ -64,8 +64,7 @@ raw['identity'] = raw.apply(find_ident, q_cols=q_c, axis=1)
 print('Merging rank columns...')
 rank_cols = ['status.5','status.4','status.3','status.2', 
              'status.1', 'status']
-raw['rank'] = raw.apply(col_merge, cols=rank_cols, 
-                        fill_na='likely-undergrad', axis=1)
+raw['rank'] = merge_cols(raw, rank_cols, fill_na='likely-undergrad')
 
 #Simplify column names
 print('Renaming columns...')
@@ -60,11 +60,10 @@ would be biased in favor of those with more of the same questions.
 '''
 df = df.replace({'Question: Q\d*\w?; Answer:': ''}, regex=True)
 
-print('Combining answers from each code into documents...')
-documents = nlp.make_docs(df, code_cols, text_col)
-
 print('Calculating cosine similarity between all codes...')
-result = nlp.cosine_sim_pd(docs=documents, codes=code_cols)
+#equivalent to cosine_sim_pd() on make_docs() output, but tokenizes
+#each answer once rather than once per code
+result = nlp.code_sim_pd(df, code_cols, text_col)
 
 print('Results:')
 print(result)
@@ -1,16 +1,16 @@
 # @author Jeff Lockhart <jwlock@umich.edu>
 # Example script computing the pairwise similarity of people and/or 
-# responses in a sample. Serial implementation. 
-# Time complexity: O((n^2 -n)/2) 
-# Space complexity: O(n^2)
-# (i.e. this is very slow for medium data sets--see the parallel 
-# implementation for speed).
-# version 1.3
+# responses in a sample. Serial implementation using sparse
+# matrix products over blocks of rows. 
+# Space complexity: bounded by a memory budget per tile, plus the 
+# edge list (which can be streamed to disk)
+# version 1.4
 
 import pandas as pd
 import sys
 sys.path.insert(0,'../')
 from network_utils import *
+from dedoose_utils import save_frame
 
 print('Loading, indexing, and grouping data...')
 #read in all coded data
@@ -21,14 +21,13 @@ answers = answers.set_index(['uni', 'Participant', 'Start'])
 people = answers.groupby(level=['uni', 'Participant']).any()
 
 print('Computing person v person Jaccard similarity...')
-(m, r) = all_v_all_jaccard_sim(people)
-r.to_csv('../data/people_jaccard.tsv', sep='\t')
+(m, r) = jaccard_edges(people)
+save_frame(r, '../data/people_jaccard.feather', compact=True)
 m.to_csv('../data/people_jaccard_ids.tsv', sep='\t')
 
 print('Computing answer v answer Jaccard similarity...')
-# Warning: at n = 9,000, this is a 12+ hour computation and a 350 MB file
-(m, r) = all_v_all_jaccard_sim(answers)
-r.to_csv('../data/ans_jaccard.tsv', sep='\t')
+#stream edges to disk tile by tile to keep memory use bounded
+m = jaccard_to_file(answers, '../data/ans_jaccard.feather')
 m.to_csv('../data/ans_jaccard_ids.tsv', sep='\t')
 
 print('Done!')
\ No newline at end of file
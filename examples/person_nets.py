@@ -10,9 +10,10 @@ import sys
 
 sys.path.insert(0,'../')
 from network_utils import *
+from dedoose_utils import load_frame
 
 print('Reading network data files...')
-r = pd.read_csv('../data/people_jaccard.tsv', sep='\t')
+r = load_frame('../data/people_jaccard.feather')
 m = pd.read_csv('../data/people_jaccard_ids.tsv', sep='\t')
 
 print('Reading person information...')
@@ -72,7 +73,8 @@ print('Flattening sexualiies into a single variable...')
 attr['sexuality'] = attr.apply(flatten_sexuality, axis=1)
 
 print('Creating network...')
-g = make_net_list(r, attributes=attr)
+g = make_net_list(r, attributes=attr, 
+                  attr_cols=['uni', 'identity', 'rank', 'gender', 'sexuality'])
 
 print('Saving network...')
 nx.write_pajek(g, '../data/person.net')
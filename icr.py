@@ -4,30 +4,70 @@
 # utility functions for inter-coder reliability
 # version 1.0
 
+import warnings
+import numpy as np
 import pandas as pd
-from sklearn.metrics import cohen_kappa_score
-import os
-import sys
-dir_path = os.path.dirname(os.path.realpath(__file__))
-sys.path.insert(0,dir_path+'/outside_code/')
-import krippendorff_alpha as ka
+from multiprocessing import Pool
+
+def union_axes(coders):
+    '''The union of the excerpts (sorted) and of the codes (in the order
+    we first see them) of a list of coder data frames.
+    '''
+    #union of excerpts, built once
+    index = coders[0].index.append([c.index for c in coders[1:]])
+    index = index.unique().sort_values()
+    cols = list(coders[0].columns.values)
+    for c in coders[1:]:
+        cols = cols + [col for col in c.columns.values if col not in cols]
+    return (index, cols)
+
+def align_coders(coders):
+    '''Align the code applications of several coders on the union of 
+    the excerpts any of them coded, in a single allocation.
+    Input:
+        coders: a list of data frames with code applications
+    Returns the union index of excerpts, the list of codes, an int8 array
+    of codes (coder x excerpt x code) and a boolean array of the same 
+    shape marking which values each coder actually recorded.
+    '''
+    (index, cols) = union_axes(coders)
+    
+    shape = (len(coders), len(index), len(cols))
+    codes = np.zeros(shape, dtype=np.int8)
+    mask = np.zeros(shape, dtype=bool)
+    
+    for (k, c) in enumerate(coders):
+        rows = index.get_indexer(c.index)
+        values = c.reindex(columns=cols).values
+        recorded = pd.notnull(values)
+        mask[k, rows] = recorded
+        codes[k, rows] = np.where(recorded, values, 0).astype(np.int8)
+    
+    return (index, cols, codes, mask)
+
+def aligned(coders):
+    '''Accept either a list of coder data frames or the output of 
+    align_coders(), and return the latter.
+    '''
+    if isinstance(coders, tuple):
+        return coders
+    return align_coders(coders)
 
 def count_codes(coders, min_coders=1, max_coders=99999, 
                 keep_coder_counts=False):
     '''Counts the number of coders who applied each code to each 
     excerpt.
     Input: 
-        coders: a list of data frames with code applications
+        coders: a list of data frames with code applications, or the 
+        output of align_coders()
         keep_coder_counts: whether to keep the column counting number 
         of coders who coded an excerpt
     '''
-    result = coders[0].copy()
-    result['xxx_n_coders_xxx'] = 1
+    (index, cols, codes, mask) = aligned(coders)
     
-    for i in range(1, len(coders)):
-        tmp = coders[i]
-        tmp['xxx_n_coders_xxx'] = 1
-        result = result.add(tmp, fill_value=0)
+    result = pd.DataFrame((codes * mask).sum(axis=0), index=index, 
+                          columns=cols)
+    result['xxx_n_coders_xxx'] = mask.any(axis=2).sum(axis=0)
     
     #select only the rows where we have the right number of coders
     result = result[(result['xxx_n_coders_xxx'] >= min_coders) & 
@@ -42,7 +82,8 @@ def simple_merge(coders, threshold=1, unanimous=False,
                  keep_coder_counts=False):
     '''A simple merge of the codes from multiple coders.
     Input:
-        coders: a list of data frames of code applications
+        coders: a list of data frames of code applications, or the 
+        output of align_coders()
         threshold: minimum number of coders applying a code for 
         us to use it. 
         unanimous: require all coders who coded an excerpt to 
@@ -50,25 +91,21 @@ def simple_merge(coders, threshold=1, unanimous=False,
     '''
     counts = count_codes(coders, min_coders=threshold, 
                          keep_coder_counts=True)
-    result = pd.DataFrame()
+    n_coders = counts.pop('xxx_n_coders_xxx')
     
     if unanimous:
-        for c in counts.columns.values:
-            #we selected n_coders > threshold already
-            result[c] = (counts[c] == counts['xxx_n_coders_xxx'])
-    
+        #we selected n_coders > threshold already
+        result = counts.eq(n_coders, axis=0)
     else:
-        for c in counts.columns.values:
-            #we have enough coders, but do enough of them 
-            #agree on this code?
-            result[c] = (counts[c] >= threshold)
+        #we have enough coders, but do enough of them 
+        #agree on this code?
+        result = counts >= threshold
     
-    if not keep_coder_counts:
-        result = result.drop('xxx_n_coders_xxx', axis=1)
+    if keep_coder_counts:
+        result['xxx_n_coders_xxx'] = n_coders
     
     return result
 
-
 def summarize(df):
     '''Returns a DataFrame with counts for each column/code. Useful 
     for diagnostics.
@@ -81,171 +118,556 @@ def summarize(df):
     
     return pd.concat(r).fillna(0)
 
-def percent_agreement(code_counts, n_coders):
-    '''Returns the simple percent agreement statistic for two coders'''
-    s = summarize(code_counts)
-    n_rows = 1.0 * code_counts.shape[0]
-    avg = 0.0
-    r = pd.DataFrame()
+def agreement_table(x, y, codes=None):
+    '''2x2 agreement counts for every code at once, from two aligned
+    boolean (excerpt x code) matrices, one per coder. Returns a data 
+    frame with one row per code and the number of excerpts where both
+    coders, only the first, only the second, or neither applied it.
+    '''
+    x = np.asarray(x, dtype=bool)
+    y = np.asarray(y, dtype=bool)
+    
+    table = pd.DataFrame(index=codes)
+    table['both'] = (x & y).sum(axis=0)
+    table['first'] = (x & ~y).sum(axis=0)
+    table['second'] = (~x & y).sum(axis=0)
+    table['neither'] = (~x & ~y).sum(axis=0)
+    table['disagree'] = table['first'] + table['second']
+    
+    return table
+
+def counts_table(code_counts):
+    '''Agreement counts from the output of count_codes() for two coders.
+    Counts don't say which coder applied a code when they disagree, so 
+    first and second are unknown (NaN).
+    '''
+    cc = code_counts.values
+    
+    table = pd.DataFrame(index=code_counts.columns)
+    table['both'] = (cc == 2).sum(axis=0)
+    table['first'] = np.nan
+    table['second'] = np.nan
+    table['neither'] = (cc == 0).sum(axis=0)
+    table['disagree'] = (cc == 1).sum(axis=0)
+    
+    return table
+
+def agreement_stats(table):
+    '''Percent agreement, Scott's pi, Cohen's kappa and Krippendorff's 
+    alpha for two coders with binary codes and no missing values, for 
+    every row of an agreement table at once. Undefined statistics (e.g.
+    for codes nobody ever applied) are NaN.
+    '''
+    both = table['both'].values.astype(float)
+    disagree = table['disagree'].values.astype(float)
+    neither = table['neither'].values.astype(float)
+    n = both + disagree + neither
+    r = pd.DataFrame(index=table.index)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pa = 1 - (disagree / n)
+        r['percent_agree'] = pa
+        
+        #Scott's pi: expected agreement from the joint proportions 
+        #of cells with and without the code
+        jp_true = ( (disagree + (2 * both)) / (2 * n) ) ** 2
+        jp_false = ( (disagree + (2 * neither)) / (2 * n) ) ** 2
+        expected = jp_true + jp_false
+        r['scotts_pi'] = np.where(expected < 1, 
+                                  (pa - expected) / (1 - expected), np.nan)
+        
+        #Cohen's kappa: expected agreement from each coder's own rate
+        p1 = (both + table['first'].values) / n
+        p2 = (both + table['second'].values) / n
+        expected = (p1 * p2) + ((1 - p1) * (1 - p2))
+        r['cohens_kappa'] = np.where(expected < 1, 
+                                     (pa - expected) / (1 - expected), np.nan)
+        
+        #Krippendorff's alpha: row sum product = 
+        #(actual neg + disagree) * (actual pos + disagree)
+        rs = ( (neither * 2) + disagree ) * ( (both * 2) + disagree )
+        r['krippendorffs_alpha'] = np.where(rs > 0, 
+            1 - (((2 * n) - 1) * (disagree / rs)), np.nan)
+    
+    return r
+
+def pair_table(codes1, codes2):
+    '''Align two coders and return the agreement table over the 
+    excerpts both of them coded, with the number of those excerpts where
+    at least one coder applied each code (n).
+    '''
+    (index, cols, codes, mask) = align_coders([codes1, codes2])
+    #excerpts coded by both
+    rows = mask.any(axis=2).all(axis=0)
+    x = (codes[0] * mask[0])[rows]
+    y = (codes[1] * mask[1])[rows]
+    
+    table = agreement_table(x, y, codes=cols)
+    table['n'] = ((x + y) > 0).sum(axis=0)
     
+    return table
+
+def fleiss_stats(ones, m):
+    '''Pairwise-averaged percent agreement and Fleiss' kappa for every 
+    code at once. Excerpts may have different numbers of coders; those 
+    with fewer than 2 are ignored. With 2 coders these are the same as 
+    percent agreement and Scott's pi.
+    Input:
+        ones: excerpt x code array, number of coders applying each code
+        m: excerpt x code array, number of coders who coded it
+    '''
+    ones = np.asarray(ones, dtype=float)
+    m = np.asarray(m, dtype=float) * np.ones(ones.shape)
+    zeros = m - ones
+    pairable = m > 1
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #share of the pairs of coders on each excerpt who agree
+        p_i = ( (ones * (ones - 1)) + (zeros * (zeros - 1)) ) / (m * (m - 1))
+        agree = np.where(pairable, p_i, 0).sum(axis=0) / pairable.sum(axis=0)
+        
+        #expected agreement from the overall rate of each code
+        p = (np.where(pairable, ones, 0).sum(axis=0) / 
+             np.where(pairable, m, 0).sum(axis=0))
+        expected = (p ** 2) + ((1 - p) ** 2)
+        kappa = np.where(expected < 1, 
+                         (agree - expected) / (1 - expected), np.nan)
+    
+    return (agree, kappa)
+
+def percent_agreement(code_counts, n_coders):
+    '''Returns the simple percent agreement statistic. For 3+ coders,
+    this is the share of pairs of coders who agree, averaged over 
+    excerpts. Assumes every excerpt was coded by n_coders coders.
+    '''
     if n_coders == 2:
-        r['percent_agree'] = 1 - (s[1] / n_rows)
-        avg = r['percent_agree'].mean()
+        r = agreement_stats(counts_table(code_counts))[['percent_agree']]
         
     elif n_coders < 2:
-        print 'Must have at least 2 coders to compare.'
+        print('Must have at least 2 coders to compare.')
         return
     else:
-        print '3+ coder percent agreement not yet implemented.'
-        return
+        (agree, kappa) = fleiss_stats(code_counts.values, n_coders)
+        r = pd.DataFrame({'percent_agree': agree}, index=code_counts.columns)
         
-    return (r, avg)
+    return (r, r['percent_agree'].mean())
+
+def fleiss_kappa(code_counts, n_coders):
+    '''Fleiss' kappa for any number of coders. Assumes every excerpt was
+    coded by n_coders coders.
+    Fleiss, J. L. (1971). Measuring nominal scale agreement among many raters. Psychological Bulletin, 76(5), 378–382.
+    '''
+    (agree, kappa) = fleiss_stats(code_counts.values, n_coders)
+    r = pd.DataFrame({'fleiss_kappa': kappa}, index=code_counts.columns)
+    
+    return (r, r['fleiss_kappa'].mean())
+
+def pairwise_kappa(coders, names=None, mem_budget=2**28):
+    '''Cohen's kappa between every pair of coders for every code, each 
+    over the excerpts both coders coded, computed for all pairs at once.
+    Input:
+        coders: a list of data frames of code applications, or the 
+        output of align_coders()
+        names: labels for the coders, defaults to 0, 1, 2...
+        mem_budget: approximate bytes for the float copies of each block
+        of codes
+    Returns a data frame of kappas with one row per code and one column
+    per pair of coders, and a coders x coders data frame of the mean 
+    kappa across codes.
+    '''
+    (index, cols, codes, mask) = aligned(coders)
+    if names is None:
+        names = list(range(0, codes.shape[0]))
+    (n_coders, n_units, n_codes) = codes.shape
+    
+    #coder x coder x code counts over the excerpts both coders coded
+    n = np.zeros((n_coders, n_coders, n_codes))
+    both = np.zeros(n.shape)
+    first = np.zeros(n.shape)
+    #a block of codes at a time, as code x coder x excerpt float32 
+    #copies (exact for counts below 2**24)
+    block = max(1, int(mem_budget // (8 * n_coders * max(1, n_units))))
+    for start in range(0, n_codes, block):
+        stop = min(start + block, n_codes)
+        m = mask[:, :, start:stop].transpose(2, 0, 1).astype(np.float32)
+        x = (codes[:, :, start:stop] * mask[:, :, start:stop])\
+            .transpose(2, 0, 1).astype(np.float32)
+        n[:, :, start:stop] = np.matmul(m, m.transpose(0, 2, 1))\
+            .transpose(1, 2, 0)
+        both[:, :, start:stop] = np.matmul(x, x.transpose(0, 2, 1))\
+            .transpose(1, 2, 0)
+        first[:, :, start:stop] = np.matmul(x, m.transpose(0, 2, 1))\
+            .transpose(1, 2, 0)
+    second = first.transpose(1, 0, 2)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #agree = both applied + neither applied
+        pa = (both + (n - first - second + both)) / n
+        p1 = first / n
+        p2 = second / n
+        expected = (p1 * p2) + ((1 - p1) * (1 - p2))
+        kappa = np.where(expected < 1, (pa - expected) / (1 - expected), 
+                         np.nan)
+    
+    (a, b) = np.triu_indices(len(names), 1)
+    pairs = pd.MultiIndex.from_arrays([[names[i] for i in a], 
+                                       [names[i] for i in b]])
+    r = pd.DataFrame(kappa[a, b].T, index=cols, columns=pairs)
+    
+    #mean over the codes where kappa is defined
+    defined = ~np.isnan(kappa)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(defined, kappa, 0).sum(axis=2) / defined.sum(axis=2)
+    
+    return (r, pd.DataFrame(mean, index=names, columns=names))
 
 def scotts_pi(code_counts):
     '''Scott's Pi statistic. Assumes two coders, no missing data.
     Scott, W. A. (1955). Reliability of Content Analysis: The Case of Nominal Coding. Public Opinion Quarterly, 19(3), 321–325
     '''
-
-    s = summarize(code_counts)
-    pa, avg_pa = percent_agreement(code_counts, n_coders=2)
-
-    #number of coded excerpts (x2 for 2 coders)
-    n_obs = code_counts.shape[0] * 2.0
-    
-    #joint proportion squared for when each code is and is not applied
-    #total number of 'true' cells over total cells
-    pa['jp_true'] = ( (s[1] + (2 * s[2])) / n_obs ) ** 2
-    #total 'false' cells over total cells
-    pa['jp_false'] = ( (s[1] + (2 * s[0])) / n_obs ) ** 2
-    #expected agreement
-    pa['expected'] = pa['jp_true'] + pa['jp_false']
-        
-    pa['scotts_pi'] = ( ( pa['percent_agree'] - pa['expected'] ) 
-                       / (1 - pa['expected']) )
+    r = agreement_stats(counts_table(code_counts))[['scotts_pi']]
     
-    return (pa[['scotts_pi']], pa['scotts_pi'].mean())
+    return (r, r['scotts_pi'].mean())
 
 def krippendorffs_alpha(code_counts):
     '''krippendorff's alpha in the case of: binary data, two coders, no missing values
     http://web.asc.upenn.edu/usr/krippendorff/mwebreliability5.pdf
     '''
-    code_counts
-    s = summarize(code_counts)
-    n = code_counts.shape[0] * 2
+    r = agreement_stats(counts_table(code_counts))[['krippendorffs_alpha']]
     
-    #obs disagree = cases where only 1 coder applied the code
-    s['Do'] = s[1] 
-    #row sum product = (actual neg + disagree) * (actual pos + disagree)
-    s['rs'] = ( (s[0] * 2) + s[1] ) * ( (s[2] * 2) + s[1])
-    
-    s['krippendorffs_alpha'] = 1 - ((n - 1) * (s['Do'] / s['rs']))
-    
-    return (s[['krippendorffs_alpha']], s['krippendorffs_alpha'].mean())
+    return (r, r['krippendorffs_alpha'].mean())
 
 def cohens_kappa(codes1, codes2):
     '''Cohen's Kappa statistic. Assumes 2 coders, no missing data.
     Cohen, J. (1960). A Coefficient of Agreement for Nominal Scales. Educational and Psychological Measurement, XX(1), 37–46.
     '''
-    r = []
-    code_counts = count_codes([codes1, codes2], min_coders=2, keep_coder_counts=True)
-    s = summarize(code_counts)
-    s['cohens_kappa'] = 0
-    
-    code_cols = codes1.columns.values
-    
-    x = codes1.copy()
-    y = codes2.copy()
-    x['n_coders'] = code_counts['xxx_n_coders_xxx']
-    y['n_coders'] = code_counts['xxx_n_coders_xxx']
-    x = x[x['n_coders'] == 2]
-    y = y[y['n_coders'] == 2]
-    
-    for c in code_cols:
-        k = cohen_kappa_score(x[c].values, y[c].values)
-        s.ix[c, 'cohens_kappa'] = k
+    r = agreement_stats(pair_table(codes1, codes2))[['cohens_kappa']]
         
-    return (s[['cohens_kappa']], s['cohens_kappa'].mean())
+    return (r, r['cohens_kappa'].mean())
 
 def compute_icr(codes1, codes2):
     '''Returns several measures of intercoder reliability for two coders 
     with binary codes and no missing values.
     '''
-    counts = count_codes([codes1, codes2], min_coders=2)
-
-    ka, avg = krippendorffs_alpha(counts)
-    pi, avg = scotts_pi(counts)
-    pa, avg = percent_agreement(counts, n_coders=2)
-    ck, avg = cohens_kappa(codes1, codes2)
+    table = pair_table(codes1, codes2)
     
-    #merge our metrics into a single dataframe
-    together = pd.concat([ka, pi, ck,pa], axis=1).sort_values(by='krippendorffs_alpha')
-    
-    #add a column for the number of excerpts matching each code at least once
-    together['n'] = 0
-    for c in counts.columns.values:
-        together.ix[c, 'n'] = counts[counts[c] > 0].shape[0]
-        
-    return together.drop('xxx_n_coders_xxx')
-
-def get_k_alpha(coders, col_name):
-    '''Wrapper for external krippendorff function. Works with 
-    multiple coders and missing data.'''
-    tmp = []
-    for c in coders:
-        tmp.append(c[col_name].to_dict())
+    #all of our metrics from the same agreement counts
+    together = agreement_stats(table)[['krippendorffs_alpha', 'scotts_pi', 
+                                       'cohens_kappa', 'percent_agree']]
+    #the number of excerpts matching each code at least once
+    together['n'] = table['n']
         
-    return ka.krippendorff_alpha(data = tmp, 
-                                 metric = ka.nominal_metric)
-
-def get_n(row, counts):
-    c = row['code']
-    return counts[counts[c] > 0].shape[0]
-
-def compute_multi_icr(coders):
-    '''ICR for multiple coders and missing values. 
-    Returns a data frame with Krippendorffs alpha and
-    the number of items used to calculate it (i.e. 
-    those coded by more than one coder).'''
-    
-    #find alphas
-    result = []
-    cols = coders[0].columns.values
-    i = 0
-    for col in cols:
-        tmp = {}
-        tmp['code'] = col
-        tmp['alpha'] = get_k_alpha(coders, col)
-        result.append(tmp)
-        i += 1
-        print 'Finished', i, 'of', len(cols)
-        
-    #Save alphas in dataframe
-    r = pd.DataFrame.from_records(result)
+    return together.sort_values(by='krippendorffs_alpha')
+
+def compute_multi_agreement(coders, names=None):
+    '''Agreement for any number of coders and missing values, from one 
+    alignment of the coders. Returns a data frame with pairwise-averaged
+    percent agreement, Fleiss' kappa, the mean of Cohen's kappa over all
+    pairs of coders, and the number of items used (i.e. those coded by 
+    more than one coder with the code applied at least once).
+    '''
+    (index, cols, codes, mask) = aligned(coders)
+    ones = (codes * mask).sum(axis=0)
     
-    #find coder counts for each item
-    cs = count_codes(coders, min_coders=2)
+    (agree, kappa) = fleiss_stats(ones, mask.sum(axis=0))
+    (pairs, mean) = pairwise_kappa((index, cols, codes, mask), names)
     
-    #store n items with each code
-    r['n'] = r.apply(get_n, counts=cs, axis=1)
+    #excerpts coded by 2+ coders where at least one applied each code
+    n_coders = mask.any(axis=2).sum(axis=0)
+    n = ((ones > 0) & (n_coders >= 2)[:, np.newaxis]).sum(axis=0)
     
-    return r.sort_values(by='alpha', ascending=False)
-
-
-
-
-
-
-
-
-
-
+    return pd.DataFrame({'percent_agree': agree, 'fleiss_kappa': kappa,
+                         'mean_cohens_kappa': pairs.mean(axis=1).values, 
+                         'n': n}, index=cols)
+
+def unit_sums(codes, mask):
+    '''Per-excerpt sums behind the reliability statistics, so that any
+    resample of excerpts can be scored by summing rows. Returns an 
+    excerpt x (code * sum) array, keeping only excerpts that at
+    least two coders coded. The sums for each code are: coders applying 
+    it, coders not applying it, disagreeing pairs (for alpha), share of
+    agreeing pairs (for Fleiss' kappa), whether the excerpt is pairable,
+    and for exactly two coders, the both/first only/second only counts.
+    '''
+    x = codes * mask
+    m = mask.sum(axis=0).astype(float)
+    ones = x.sum(axis=0).astype(float)
+    zeros = m - ones
+    pairable = m > 1
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        o_01 = ones * zeros / (m - 1)
+        p_i = ( (ones * (ones - 1)) + (zeros * (zeros - 1)) ) / (m * (m - 1))
+    sums = [ones, zeros, o_01, p_i, np.ones(m.shape)]
+    
+    if codes.shape[0] == 2:
+        sums.append(x[0] * x[1])
+        sums.append(x[0] * (1 - x[1]))
+        sums.append((1 - x[0]) * x[1])
+    
+    sums = np.stack([np.where(pairable, f, 0) for f in sums], axis=2)
+    keep = pairable.any(axis=1)
+    
+    sums = sums[keep]
+    return sums.reshape(sums.shape[0], 
+                        sums.shape[1] * sums.shape[2]).astype(float)
 
+def stats_from_sums(sums, n_codes):
+    '''Reliability statistics for every code from (resample x code * sum)
+    totals of unit_sums(). Returns a dict of resample x code arrays.
+    '''
+    sums = sums.reshape(sums.shape[0], n_codes, -1)
+    n_1 = sums[:, :, 0]
+    n_0 = sums[:, :, 1]
+    n = n_0 + n_1
+    units = sums[:, :, 4]
+    r = {}
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r['alpha'] = np.where(n_0 * n_1 > 0, 
+                              1. - (n - 1) * sums[:, :, 2] / (n_0 * n_1), 
+                              np.nan)
+        
+        agree = sums[:, :, 3] / units
+        p = n_1 / n
+        expected = (p ** 2) + ((1 - p) ** 2)
+        r['percent_agree'] = agree
+        r['fleiss_kappa'] = np.where(expected < 1, 
+                                     (agree - expected) / (1 - expected), 
+                                     np.nan)
+        
+        if sums.shape[2] > 5:
+            #Cohen's kappa for two coders
+            p1 = (sums[:, :, 5] + sums[:, :, 6]) / units
+            p2 = (sums[:, :, 5] + sums[:, :, 7]) / units
+            expected = (p1 * p2) + ((1 - p1) * (1 - p2))
+            r['cohens_kappa'] = np.where(expected < 1, 
+                                         (agree - expected) / (1 - expected),
+                                         np.nan)
+    
+    return r
 
+#per-excerpt sums shared with each worker process by set_unit_sums()
+worker_sums = {}
 
+def set_unit_sums(sums, n_codes):
+    '''Pool initializer for bootstrap_icr(), so the sums are sent to 
+    each worker once rather than with every batch.
+    '''
+    worker_sums['sums'] = sums
+    worker_sums['n_codes'] = n_codes
 
+def bootstrap_batch(job):
+    '''Map function for bootstrap_icr(). Draws a batch of resamples of 
+    excerpts (as counts of how often each excerpt is drawn) and scores 
+    them all with one matrix product.
+    '''
+    (seed, size) = job
+    sums = worker_sums['sums']
+    rng = np.random.default_rng(seed)
+    n_units = sums.shape[0]
+    
+    weights = rng.multinomial(n_units, np.full(n_units, 1.0 / n_units), 
+                              size=size).astype(float)
+    
+    return stats_from_sums(weights.dot(sums), worker_sums['n_codes'])
+
+def bootstrap_icr(coders, n_boot=1000, ci=0.95, seed=None, processes=1, 
+                  batch_size=100):
+    '''Bootstrap confidence intervals for Krippendorff's alpha, 
+    pairwise-averaged percent agreement, Fleiss' kappa and (for two
+    coders) Cohen's kappa, for every code. Excerpts are resampled with
+    replacement.
+    Input:
+        coders: a list of data frames of code applications, or the 
+        output of align_coders()
+        n_boot: number of resamples
+        ci: width of the percentile confidence intervals
+        seed: seed for the resampling. Results are the same for the same
+        seed whatever the number of processes.
+        processes: number of worker processes, or None for all cores
+        batch_size: number of resamples scored at a time
+    Returns a data frame with one row per code and, for each statistic, 
+    its point estimate and the lower (_lo) and upper (_hi) bounds.
+    '''
+    (index, cols, codes, mask) = aligned(coders)
+    sums = unit_sums(codes, mask)
+    
+    #one independent random stream per batch
+    sizes = [min(batch_size, n_boot - b) for b in range(0, n_boot, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = list(zip(seeds, sizes))
+    
+    point = stats_from_sums(sums.sum(axis=0, keepdims=True), len(cols))
+    r = pd.DataFrame(index=cols)
+    if sums.shape[0] == 0:
+        #no excerpt was coded by 2+ coders, so there is nothing to 
+        #resample and every statistic is undefined
+        for stat in point.keys():
+            for suffix in ['', '_lo', '_hi']:
+                r[stat + suffix] = np.nan
+        return r
+    
+    if processes == 1:
+        set_unit_sums(sums, len(cols))
+        batches = [bootstrap_batch(j) for j in jobs]
+    else:
+        pool = Pool(processes, initializer=set_unit_sums, 
+                    initargs=(sums, len(cols)))
+        try:
+            batches = pool.map(bootstrap_batch, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    
+    for stat in point.keys():
+        boot = np.concatenate([b[stat] for b in batches])
+        r[stat] = point[stat][0]
+        #codes with no variation have no interval
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            r[stat + '_lo'] = np.nanpercentile(boot, 50 * (1 - ci), axis=0)
+            r[stat + '_hi'] = np.nanpercentile(boot, 50 * (1 + ci), axis=0)
+    
+    return r
 
+def alpha_distance(levels, metric='nominal'):
+    '''Squared distance between each pair of values for Krippendorff's 
+    alpha, as a matrix.
+    '''
+    a = levels[:, np.newaxis]
+    b = levels[np.newaxis, :]
+    
+    if metric == 'nominal':
+        return (a != b).astype(float)
+    elif metric == 'interval':
+        return (a - b) ** 2
+    elif metric == 'ratio':
+        #two zeros are no distance apart
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(a + b != 0, ((a - b) / (a + b)) ** 2, 0.0)
+    
+    raise ValueError('Unknown metric: ' + str(metric))
 
+def k_alpha(data, metric='nominal'):
+    '''Krippendorff's alpha for any number of coders and missing data.
+    Builds the units x values table of how many coders gave each value to
+    each unit, and from it the coincidence matrix, so the cost is linear
+    in the number of units and coders.
+    http://web.asc.upenn.edu/usr/krippendorff/mwebreliability5.pdf
+    Input:
+        data: coders x units array, masked array or data frame of numeric
+        values. Missing values are NaN (or masked).
+        metric: 'nominal', 'interval' or 'ratio'
+    '''
+    values = np.ma.masked_invalid(np.ma.asarray(data, dtype=float))
+    observed = ~np.ma.getmaskarray(values)
+    n_units = values.shape[1]
+    
+    #the distinct values coders used, and which one each observation is
+    (levels, v) = np.unique(values.data[observed], return_inverse=True)
+    u = np.nonzero(observed)[1]
+    #units x values table of counts
+    n_uv = np.bincount(u * len(levels) + v.ravel(), 
+                       minlength=n_units * len(levels))
+    n_uv = n_uv.reshape(n_units, len(levels)).astype(float)
+    
+    #only units with 2+ values are pairable
+    m_u = n_uv.sum(axis=1)
+    n_uv = n_uv[m_u > 1]
+    m_u = m_u[m_u > 1]
+    
+    #coincidence matrix: pairs of values within units, excluding each 
+    #value paired with itself
+    weighted = n_uv / (m_u - 1)[:, np.newaxis]
+    o = weighted.T.dot(n_uv) - np.diag(weighted.sum(axis=0))
+    n_v = o.sum(axis=1)
+    n = n_v.sum()
+    
+    d = alpha_distance(levels, metric)
+    observed_d = (o * d).sum()
+    expected_d = (np.outer(n_v, n_v) * d).sum() / (n - 1)
+    
+    if expected_d == 0:
+        #no variation at all, so alpha is undefined
+        return float('NaN')
+    
+    return 1. - observed_d / expected_d
 
+def get_k_alpha(coders, col_name, metric='nominal'):
+    '''Krippendorff's alpha of one code. Works with multiple coders and 
+    missing data.'''
+    #one row per coder, aligned on excerpts
+    tmp = pd.DataFrame([c[col_name] for c in coders])
+    
+    return k_alpha(tmp.astype(float), metric=metric)
 
+def binary_k_alpha(codes, mask):
+    '''Krippendorff's alpha for every code at once, for binary codes with
+    any number of coders and missing data. Same result as k_alpha() with
+    the nominal metric, one code at a time.
+    Input:
+        codes, mask: coder x excerpt x code arrays from align_coders()
+    '''
+    #coders who recorded each code on each excerpt, and who applied it
+    m = mask.sum(axis=0).astype(float)
+    ones = (codes * mask).sum(axis=0).astype(float)
+    zeros = m - ones
+    
+    #only excerpts with 2+ values are pairable
+    pairable = m > 1
+    n_1 = np.where(pairable, ones, 0).sum(axis=0)
+    n_0 = np.where(pairable, zeros, 0).sum(axis=0)
+    n = n_0 + n_1
+    #pairs of coders who disagree, from the coincidence matrix
+    with np.errstate(divide='ignore', invalid='ignore'):
+        o_01 = np.where(pairable, ones * zeros / (m - 1), 0).sum(axis=0)
+        alpha = 1. - (n - 1) * o_01 / (n_0 * n_1)
+    
+    #no variation at all, so alpha is undefined
+    return np.where(n_0 * n_1 > 0, alpha, np.nan)
+
+def is_binary(coders):
+    '''whether every recorded value in a list of coder data frames is 0
+    or 1, i.e. safe to store in align_coders()' int8 array'''
+    return all((c.isin([0, 1]) | c.isnull()).all().all() for c in coders)
+
+def align_values(coders, index, cols):
+    '''coder x excerpt x code float array of the raw values of a list 
+    of coder data frames, aligned like align_coders(), with NaN for 
+    missing values'''
+    values = np.full((len(coders), len(index), len(cols)), np.nan)
+    for (k, c) in enumerate(coders):
+        rows = index.get_indexer(c.index)
+        values[k, rows] = c.reindex(columns=cols).values.astype(float)
+    return values
 
+def compute_multi_icr(coders):
+    '''ICR for multiple coders and missing values. 
+    Returns a data frame with Krippendorffs alpha and
+    the number of items used to calculate it (i.e. 
+    those coded by more than one coder).
+    coders may also be the output of align_coders(), in which case the
+    codes must be binary.'''
+    if isinstance(coders, tuple) or is_binary(coders):
+        (index, cols, codes, mask) = aligned(coders)
+        #all codes at once
+        alpha = binary_k_alpha(codes, mask)
+        applied = (codes * mask).sum(axis=0) > 0
+    else:
+        #non-binary values don't fit the int8 array, and need the 
+        #general engine, one code at a time
+        (index, cols) = union_axes(coders)
+        values = align_values(coders, index, cols)
+        mask = ~np.isnan(values)
+        alpha = [k_alpha(values[:, :, i]) for i in range(0, len(cols))]
+        applied = (mask & (np.nan_to_num(values) != 0)).any(axis=0)
+    
+    #excerpts coded by 2+ coders where at least one applied each code
+    n_coders = mask.any(axis=2).sum(axis=0)
+    n = (applied & (n_coders >= 2)[:, np.newaxis]).sum(axis=0)
+    
+    r = pd.DataFrame({'code': cols, 'alpha': alpha, 'n': n})
+    
+    return r.sort_values(by='alpha', ascending=False)
 
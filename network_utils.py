@@ -3,68 +3,99 @@
 # applications in qualitative data
 # version 2.0
 
+import numpy as np
 import pandas as pd
 import networkx as nx
+from scipy import sparse
 from math import sqrt
+from multiprocessing import Pool, cpu_count, shared_memory
 
-def make_net_list(data, idx1='i', idx2='j', idx3='Jaccard', min_weight=0, attributes=None):
+def make_net_list(data, idx1='i', idx2='j', idx3='Jaccard', min_weight=0, 
+                  attributes=None, attr_cols=None, uid_col='uid'):
+    '''Create a networkx network from an edge list, such as the output 
+    of jaccard_edges().
+    Input:
+        data: a data frame with one row per edge
+        idx1, idx2: columns with the ids of the nodes of each edge
+        idx3: column with the weight of each edge
+        min_weight: ignore weights at or below this number
+        attributes: optional data frame of node attributes
+        attr_cols: attribute columns to attach to nodes. Defaults to 
+        uni, identity, rank, gender, sexuality and cis.
+        uid_col: column of attributes with the node ids
+    '''
     g = nx.Graph()
-        
-    if attributes is not None:   
-        ids = set(data[idx1]).union(set(data[idx2]))
-        for i in ids:
-            row = attributes.loc[attributes['uid'] == i]
-            g.add_node(i, uni=row['uni'].values[0], 
-                       identity=row['identity'].values[0],
-                       rank=row['rank'].values[0], 
-                       gender=row['gender'].values[0],
-                       sexuality=row['sexuality'].values[0],
-                       cis=row['cis'].values[0]
-                      )
-        
-    for row in data.iterrows():
-        w = row[1][idx3]
-        if w > min_weight:
-            g.add_edge(int(row[1][idx1]), int(row[1][idx2]), weight = w)  
+    
+    if attributes is not None:
+        if attr_cols is None:
+            attr_cols = ['uni', 'identity', 'rank', 'gender', 
+                         'sexuality', 'cis']
+        ids = pd.unique(np.concatenate([data[idx1].values, 
+                                        data[idx2].values]).astype(int))
+        #index the attributes once, keeping the first row for each id
+        attr = attributes.drop_duplicates(subset=uid_col)
+        attr = attr.set_index(uid_col)[attr_cols].reindex(ids)
+        g.add_nodes_from(zip(ids.tolist(), attr.to_dict('records')))
+    
+    edges = data[data[idx3] > min_weight]
+    g.add_weighted_edges_from(zip(edges[idx1].values.astype(int).tolist(), 
+                                  edges[idx2].values.astype(int).tolist(), 
+                                  edges[idx3].tolist()))
     
     return g
 
-def make_net(data, min_weight=0, isolates=False, directed=False):
+def make_net(data, min_weight=0, isolates=False, directed=False, 
+             output='networkx'):
     '''Create a networkx network from our dataframe of edge weights
     Input:
         data: a symmetric pandas data frame of edge weights
         min_weight: ignore weights at or below this number
         isolates: boolean, do we include nodes without edges?
+        output: 'networkx' for a graph, 'sparse' for a scipy sparse 
+        matrix of the kept weights, or 'edgelist' for a data frame with 
+        columns source, target, weight
     '''
     nodes = data.columns.values
+    w = data.values
+    
+    #which edges have enough weight, skipping self-loops
+    keep = w > min_weight
+    np.fill_diagonal(keep, False)
+    
+    if not directed:
+        #keep each edge once, in the upper triangle. Where the lower
+        #triangle also has enough weight, its weight wins, as when 
+        #edges were added in both directions in row order.
+        lower = keep.T
+        w = np.where(lower, w.T, w)
+        keep = np.triu(keep | lower, 1)
+    
+    (r, c) = np.nonzero(keep)
+    weights = w[r, c]
+    
+    if output == 'sparse':
+        return sparse.csr_matrix((weights, (r, c)), shape=w.shape)
+    if output == 'edgelist':
+        return pd.DataFrame({'source': nodes[r], 'target': nodes[c], 
+                             'weight': weights})
     
     if directed:
         g = nx.DiGraph()
     else:
         g = nx.Graph()
-        #this case will have us add all edges twice, but nx doesn't mind
-        #and a graph of codes is too small for the performance to matter
     
     #if we want to include even nodes without edges
     if isolates:
         g.add_nodes_from(nodes)
-            
-    #iterate over data matrix
-    for r in nodes: #rows
-        for c in nodes: #columns
-            if r == c:
-                #skip self-loops
-                continue
-            #if this edge has enough weight, add it
-            if data.loc[r, c] > min_weight: 
-                g.add_edge(r, c, weight = data.loc[r, c])                      
+    
+    g.add_weighted_edges_from(zip(nodes[r].tolist(), nodes[c].tolist(), 
+                                  weights.tolist()))
 
     return g
 
 def var(x,n):
-    '''variance for proportion'''
-    n = float(n)
-    return abs(x*(1-x))/n
+    '''variance for proportion. Works elementwise on arrays, too.'''
+    return abs(x*(1-x)) / (1.0 * n)
 
 def sdiv(x,n):
     '''standard deviation for proportion'''
@@ -72,191 +103,459 @@ def sdiv(x,n):
 
 def get_freq(data):
     '''Compute the frequencies of each code/column'''
-    rows = 1.0 * data.shape[0] #number of rows as float
-    cols = data.columns.values
     stats = pd.DataFrame()
     
     stats['count'] = data.sum()
     stats['frequency'] = data.mean()
-    stats['var'] = stats['frequency'].apply(var, n=data.shape[0])
+    stats['var'] = var(stats['frequency'], n=data.shape[0])
+    
+    return stats
+
+def freq_from_counts(counts, n):
+    '''Same as get_freq(), from the pair counts of cooccur_counts() and 
+    the number of rows n instead of the data.
+    '''
+    stats = pd.DataFrame(index=counts.index)
+    
+    stats['count'] = np.diag(counts.values)
+    stats['frequency'] = stats['count'] / (1.0 * n)
+    stats['var'] = var(stats['frequency'], n=n)
     
     return stats
 
 def rand_cooccur(data, stats):
     '''Compute the probability of any two codes cooccurring, assuming 
-    the codes are independent.
+    the codes are independent. Only needs stats; data may be None.
     '''
-    cols = data.columns.values
-    rand_co = stats.copy()
+    freq = stats['frequency'].values
     
-    #create columns for each code as the probability of cooccurance
-    #with the code in each row, assuming independence
-    for c in cols:
-        rand_co[c] = rand_co['frequency'] * stats.loc[c, 'frequency']
+    #the probability of cooccurance of the code in each row with 
+    #the code in each column, assuming independence
+    rand_co = np.outer(freq, freq)
     
-    #drop vestigial columns from stats df
-    return rand_co.drop(['count', 'frequency', 'var'], axis=1)
+    return pd.DataFrame(rand_co, index=stats.index, columns=stats.index)
     
-def real_cooccur(data, stats):
-    '''Compute how often we observe codes together in the real data.'''
+def cooccur_counts(data, chunk_size=65536):
+    '''Count how many rows have each pair of codes applied, for all
+    pairs at once. The diagonal holds the count of each code alone.
+    Rows are processed in chunks of chunk_size so that the float copy 
+    of the data used for the matrix product stays small.
+    '''
     cols = data.columns.values
-    real_co = stats.copy()
-    rows = 1.0 * data.shape[0] #rows as float
+    counts = np.zeros((len(cols), len(cols)))
+    
+    for start in range(0, data.shape[0], chunk_size):
+        #float32 counts are exact for chunks under 2^24 rows
+        x = data.iloc[start:start + chunk_size].values.astype(bool)
+        x = x.astype(np.float32)
+        #one boolean matrix product gives every pair count in the chunk
+        counts += x.T.dot(x)
     
-    for r in cols: #rows
-        for c in cols: #columns
-            #set this cell to the fraction of rows with both codes
-            real_co.loc[r, c] = data[(data[r]) & 
-                                  (data[c])].shape[0] / rows
+    return pd.DataFrame(counts, index=cols, columns=cols)
+
+def real_cooccur(data, stats, counts=None, n=None):
+    '''Compute how often we observe codes together in the real data.
+    data may be None if the pair counts and number of rows n are given.
+    '''
+    if counts is None:
+        counts = cooccur_counts(data)
+    if n is None:
+        n = data.shape[0]
+    rows = 1.0 * n #rows as float
     
-    #drop vestigial columns from stats df
-    return real_co.drop(['count', 'frequency', 'var'], axis=1)
+    #the fraction of rows with both codes
+    return counts / rows
 
 def normed_diff(rand, real, stats):
     '''Compute the normalized difference between the observed
     cooccurrance rates and those expected under the assumption of
     independence for undirected graphs. 
     '''
-    #use our predicted cooccurrance matrix as a template
-    cols = rand.columns.values
-    z = rand.copy()
-
-    for r in cols: #rows
-        for c in cols: #columns
-            #difference between actual and predicted values
-            diff = (real.loc[r, c] - rand.loc[r, c]) 
-            #standard deviation under null hypothesis
-            stdiv = sqrt((stats.loc[r, 'var']) + 
-                                   (stats.loc[c, 'var']))
-            #TODO: fix this stdiv 
-            #z-scores 
-            z.loc[r, c] = diff / stdiv
+    v = stats['var'].values
     
-    return z 
+    #difference between actual and predicted values
+    diff = real.values - rand.values
+    #standard deviation under null hypothesis
+    stdiv = np.sqrt(v[:, np.newaxis] + v[np.newaxis, :])
+    #TODO: fix this stdiv 
+    
+    #z-scores, undefined for pairs of codes that never vary
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(stdiv > 0, diff / stdiv, np.nan)
+    
+    return pd.DataFrame(z, index=rand.index, columns=rand.columns)
 
 def directed_random(data, stats):
     '''Calculate the conditional probability of seeing each code given
     that we've seen each other code, assuming codes are independent.
+    Only needs stats; data may be None.
     '''
-    cols = data.columns.values
-    dr = stats.copy()  
+    freq = stats['frequency'].values
     
-    for r in cols: #rows
-        for c in cols: #columns
-            #we expect to see c in instances of r at the same
-            #rate we see c overall
-            dr.loc[r, c] = stats.loc[c, 'frequency']
+    #we expect to see c in instances of r at the same
+    #rate we see c overall, so every row is the same
+    dr = np.tile(freq, (len(freq), 1))
     
-    return dr.drop(['count', 'frequency', 'var'], axis=1)
+    return pd.DataFrame(dr, index=stats.index, columns=stats.index)
 
-def directed_proportions(data, stats):
+def directed_proportions(data, stats, counts=None):
     '''Calculate the real rate at which we see each code given
     that we have seen each other code. I.e. calcuate the condifence
     of each rule A -> B for all pairs of codes A, B.
+    data may be None if the pair counts are given.
     '''
-    cols = data.columns.values
-    dp = stats.copy()
-
-    for r in cols: #rows
-        for c in cols: #columns
-            #count of r as float
-            alone = 1.0 * stats.loc[r, 'count']
-            if alone == 0:
-                #avoid div/zero error for codes we never see
-                dp.loc[r, c] = 0
-            else:
-                #count of r and c together
-                together = data[(data[r]) & (data[c])].shape[0]
-                #divide them by the total occurances of code r
-                #to get how often we see c given we see r
-                dp.loc[r, c] = together / alone
-    
-    return dp.drop(['count', 'frequency', 'var'], axis=1)
-
-def krippendorff(data, stats):
+    if counts is None:
+        counts = cooccur_counts(data)
+    #count of each row code r as float
+    alone = 1.0 * stats['count'].values
+    
+    #divide the count of r and c together by the total occurances 
+    #of code r to get how often we see c given we see r
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dp = counts.values / alone[:, np.newaxis]
+    #avoid div/zero error for codes we never see
+    dp[alone == 0, :] = 0
+    
+    return pd.DataFrame(dp, index=counts.index, columns=counts.columns)
+
+def krippendorff(data, stats, counts=None, n=None):
     '''Calculate the Krippendorff alpha statistic for each pair of
     codes. Follows:
         [this paper](http://repository.upenn.edu/cgi/viewcontent.cgi?article=1043&context=asc_papers)
+    data may be None if the pair counts and number of rows n are given.
     '''
-    cols = data.columns.values
-    dp = stats.copy()
-    n = data.shape[0]
-
-    for r in cols: #rows
-        for c in cols: #columns
-            count_r = stats.loc[r, 'count']
-            count_c = stats.loc[c, 'count']
-            both = data[(data[r]) & (data[c])].shape[0]
-            xor = count_r + count_c - (both * 2)
-            neither = n - both - xor
-            #count each pair twice
-            both = both * 2
-            xor = xor * 2
-            neither = neither * 2
-            
-            dp.loc[r, c] = 1 - ( (n-1) * (xor / 
-                                         ((neither + xor) * (xor + both)) ) )
+    if counts is None:
+        counts = cooccur_counts(data)
+    if n is None:
+        n = data.shape[0]
+    count = stats['count'].values
+    
+    both = counts.values
+    xor = count[:, np.newaxis] + count[np.newaxis, :] - (both * 2)
+    neither = n - both - xor
+    #count each pair twice
+    both = both * 2
+    xor = xor * 2
+    neither = neither * 2
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = 1 - ( (n-1) * (xor / ((neither + xor) * (xor + both)) ) )
     
-    return dp.drop(['count', 'frequency', 'var'], axis=1)
+    return pd.DataFrame(alpha, index=counts.index, columns=counts.columns)
 
 def directed_normed_z(real, rand, stats, n):
     '''Compute the normalized difference between the observed
     cooccurrance rates and those expected under the assumption of
     independence, for directed graphs. 
     '''
-    #use our predicted cooccurrance matrix as a template
-    cols = rand.columns.values
-    z = rand.copy()
-
-    for r in cols: #rows
-        for c in cols: #columns
-            #difference between actual and predicted values
-            diff = (real.loc[r, c] - rand.loc[r, c]) 
-            
-            #pooled stddiv between overall rate and conditional rate
-            stdiv = sqrt( var(stats.loc[c, 'frequency'], n) + 
-                      var(real.loc[r, c], stats.loc[r, 'count']) )
-            
-            #z-scores 
-            z.loc[r, c] = diff / stdiv
+    freq = stats['frequency'].values
+    count = stats['count'].values
     
-    return z
+    #difference between actual and predicted values
+    diff = real.values - rand.values
+    
+    #pooled stddiv between overall rate and conditional rate
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stdiv = np.sqrt( var(freq[np.newaxis, :], n) + 
+                         var(real.values, count[:, np.newaxis]) )
+    
+        #z-scores, undefined for codes we never see and for 
+        #pairs that never vary
+        z = np.where((count[:, np.newaxis] > 0) & (stdiv > 0), 
+                     diff / stdiv, np.nan)
+    
+    return pd.DataFrame(z, index=rand.index, columns=rand.columns)
 
 def directed_lift(real, rand, stats, n):
     '''Compute the lift for rules of the form A -> B for all
     combinations of codes A, B. Lift > 1 implies positive association.
     '''
-    #use our predicted cooccurrance matrix as a template
-    cols = rand.columns.values
-    lift = rand.copy()
-
-    for r in cols: #rows
-        for c in cols: #columns
-            try:
-                lift.loc[r, c] = (real.loc[r, c] / rand.loc[r, c]) 
-            except ZeroDivisionError:
-                lift.loc[r, c] = float('NaN')
+    #lift is undefined for codes we never see
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lift = np.where(rand.values != 0, real.values / rand.values, np.nan)
     
-    return lift
+    return pd.DataFrame(lift, index=rand.index, columns=rand.columns)
 
-def norm_cooccur(data, directed=False):
+def norm_cooccur(data, directed=False, counts=None, n=None):
     '''normalize the cooccurance rates to z scores
     H0: codes are independent 
+    Input:
+        data: a data frame of boolean code applications
+        directed: compute z scores for rules A -> B instead
+        counts: pair counts from cooccur_counts(data), if already known
+        n: number of rows. data may be None if counts and n are given.
     '''
-    stats = get_freq(data)
+    #one pass over the data gives the counts every statistic needs
+    if counts is None:
+        counts = cooccur_counts(data)
+    if n is None:
+        n = data.shape[0]
+    stats = freq_from_counts(counts, n)
     
     if directed:
-        dp = directed_proportions(data, stats)
+        dp = directed_proportions(data, stats, counts=counts)
         dr = directed_random(data, stats)
-        z = directed_normed_z(dp, dr, stats, n=data.shape[0])
+        z = directed_normed_z(dp, dr, stats, n=n)
         
     else:
         rand = rand_cooccur(data, stats)
-        real = real_cooccur(data, stats)
+        real = real_cooccur(data, stats, counts=counts, n=n)
         z = normed_diff(rand, real, stats)
     
     return z
 
+class CooccurAccumulator(object):
+    '''Running cooccurrence counts for a growing (or shrinking) set of 
+    excerpts, such as daily exports from Dedoose. Holds the number of 
+    rows and the pair counts from cooccur_counts(), so absorbing a batch
+    costs time proportional to the batch, and every statistic can be 
+    computed on demand without the full history.
+    '''
+    
+    def __init__(self, codes):
+        '''codes: the list of code columns to track'''
+        self.codes = list(codes)
+        self.n = 0
+        self.counts = pd.DataFrame(0.0, index=self.codes, columns=self.codes)
+    
+    def add(self, data):
+        '''Absorb a batch of excerpts (a data frame of code applications)'''
+        self.counts += cooccur_counts(data[self.codes])
+        self.n += data.shape[0]
+        return self
+    
+    def remove(self, data):
+        '''Retract a batch of excerpts that were added before'''
+        if data.shape[0] > self.n:
+            raise ValueError('Cannot remove more excerpts than were added.')
+        self.counts -= cooccur_counts(data[self.codes])
+        self.n -= data.shape[0]
+        return self
+    
+    def update(self, batches):
+        '''Absorb each batch in an iterable of data frames, such as 
+        chunks read from a large export.
+        '''
+        for data in batches:
+            self.add(data)
+        return self
+    
+    def stats(self):
+        '''Count, frequency and variance of each code, as get_freq()'''
+        return freq_from_counts(self.counts, self.n)
+    
+    def norm_cooccur(self, directed=False):
+        '''z scores of the cooccurance rates, as norm_cooccur()'''
+        return norm_cooccur(None, directed=directed, counts=self.counts, 
+                            n=self.n)
+    
+    def proportions(self):
+        '''Conditional probability of each code given each other code, 
+        as directed_proportions()
+        '''
+        return directed_proportions(None, self.stats(), counts=self.counts)
+    
+    def lift(self):
+        '''Lift of each rule A -> B, as directed_lift()'''
+        stats = self.stats()
+        return directed_lift(self.proportions(), 
+                             directed_random(None, stats), stats, self.n)
+
+#code matrix and strata shared with each worker process by set_null_data()
+worker_null = {}
+
+def set_null_data(x, strata, mem_budget):
+    '''Set the data for null_batch() in this process.'''
+    worker_null['x'] = x
+    worker_null['strata'] = strata
+    worker_null['mem_budget'] = mem_budget
+
+def attach_null_data(name, shape, strata, mem_budget):
+    '''Pool initializer for permutation_pvalues(). Maps the boolean code
+    matrix from shared memory, so it is stored once for all workers 
+    rather than copied into each of them.
+    '''
+    shm = shared_memory.SharedMemory(name=name)
+    #keep the segment open for as long as the worker uses it
+    worker_null['shm'] = shm
+    set_null_data(np.ndarray(shape, dtype=bool, buffer=shm.buf), strata, 
+                  mem_budget)
+
+def blocked_null_counts(x, strata, rng, width):
+    '''Pair counts of one permutation of x, for data too large to 
+    permute all at once. Columns are shuffled width at a time into a 
+    boolean copy of the data, and the counts are multiplied out one pair 
+    of column blocks at a time.
+    '''
+    (n, m) = x.shape
+    #codes x rows, so each sort runs along contiguous memory
+    shuffled = np.empty((m, n), dtype=bool)
+    for start in range(0, m, width):
+        stop = min(start + width, m)
+        keys = rng.random((stop - start, n))
+        keys += strata
+        order = np.argsort(keys, axis=1)
+        del keys
+        shuffled[start:stop] = np.take_along_axis(x[:, start:stop].T, 
+                                                  order, axis=1)
+    
+    counts = np.zeros((m, m))
+    for a in range(0, m, width):
+        block_a = shuffled[a:a + width].astype(np.float32)
+        for b in range(a, m, width):
+            block_b = shuffled[b:b + width].astype(np.float32)
+            counts[a:a + width, b:b + width] = block_a.dot(block_b.T)
+            counts[b:b + width, a:a + width] = counts[a:a + width, 
+                                                      b:b + width].T
+    return counts
+
+def null_batch(job):
+    '''Map function for permutation_pvalues(). Shuffles each code column
+    independently within strata for a batch of permutations, and counts 
+    how often each permuted pair count is at least (ge) or at most (le)
+    the observed count.
+    '''
+    (seed, size, observed) = job
+    x = worker_null['x']
+    strata = worker_null['strata']
+    mem_budget = worker_null['mem_budget']
+    (n, m) = x.shape
+    rng = np.random.default_rng(seed)
+    ge = np.zeros((m, m))
+    le = np.zeros((m, m))
+    
+    #keys, sort order and shuffled copy of the data for each permutation
+    per_perm = n * m * 20
+    if per_perm > mem_budget:
+        #one permutation doesn't fit, so shuffle blocks of columns into
+        #a boolean copy (n * m bytes), at about 28 bytes per cell of a 
+        #block for keys, order and products
+        width = int((mem_budget - n * m) // (n * 28))
+        width = min(m, max(1, width))
+        for p in range(0, size):
+            counts = blocked_null_counts(x, strata, rng, width)
+            ge += counts >= observed
+            le += counts <= observed
+        return (ge, le)
+    
+    step = max(1, int(mem_budget // per_perm))
+    for start in range(0, size, step):
+        b = min(step, size - start)
+        #sorting random keys offset by stratum shuffles rows within strata.
+        #Codes x rows, so each sort runs along contiguous memory.
+        keys = rng.random((b, m, n))
+        keys += strata
+        order = np.argsort(keys, axis=2)
+        del keys
+        shuffled = np.take_along_axis(np.broadcast_to(x.T, (b, m, n)), 
+                                      order, axis=2).astype(np.float32)
+        del order
+        #pair counts for every permutation with one batched product
+        counts = np.matmul(shuffled, shuffled.transpose(0, 2, 1))
+        ge += (counts >= observed).sum(axis=0)
+        le += (counts <= observed).sum(axis=0)
+    
+    return (ge, le)
+
+def bh_fdr(p):
+    '''Benjamini-Hochberg false discovery rate adjusted p-values (q values)
+    for a 1-d array of p-values.
+    '''
+    p = np.asarray(p, dtype=float)
+    order = np.argsort(p)
+    ranked = p[order] * len(p) / np.arange(1, len(p) + 1)
+    #q values can only go down as p goes down
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    q = np.empty(len(p))
+    q[order] = np.minimum(ranked, 1)
+    return q
+
+def permutation_pvalues(data, n_perm=1000, strata=None, tail='upper', 
+                        seed=None, processes=1, batch_size=50, 
+                        mem_budget=2**28):
+    '''Empirical p-values for the cooccurrence of each pair of codes, 
+    under a null where each code is shuffled across rows independently,
+    keeping how often each code is applied (within each stratum, if 
+    given). Unlike the z scores of norm_cooccur(), this doesn't rely on
+    a variance formula.
+    Input:
+        data: a data frame of boolean code applications
+        n_perm: number of permutations
+        strata: optional labels (one per row, e.g. participant or uni) 
+        to shuffle within
+        tail: 'upper' tests for codes that attract each other, 'lower'
+        for codes that repel each other
+        seed: seed for the permutations. Results are the same for the 
+        same seed whatever the number of processes.
+        processes: number of worker processes, or None for all cores
+        batch_size: number of permutations per job
+        mem_budget: approximate bytes each worker uses per batch. When 
+        one permutation (about 20 bytes per cell of data) doesn't fit, 
+        columns are shuffled a block at a time, and the floor is then a 
+        boolean copy of the data plus one column's keys and order. The
+        data themselves (one byte per cell, shared by all workers) are 
+        not counted.
+    Returns data frames of p-values and of Benjamini-Hochberg q values 
+    (adjusted over all pairs of different codes).
+    '''
+    cols = data.columns.values
+    x = data.values.astype(bool)
+    observed = cooccur_counts(data).values
+    if strata is None:
+        strata = np.zeros(x.shape[0])
+    else:
+        strata = pd.factorize(np.asarray(strata))[0].astype(float)
+    
+    #one independent random stream per batch
+    sizes = [min(batch_size, n_perm - b) for b in range(0, n_perm, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(sd, size, observed) for (sd, size) in zip(seeds, sizes)]
+    
+    if processes == 1:
+        set_null_data(x, strata, mem_budget)
+        result = [null_batch(j) for j in jobs]
+    else:
+        #share the codes with workers once
+        shm = shared_memory.SharedMemory(create=True, size=max(1, x.nbytes))
+        np.ndarray(x.shape, dtype=bool, buffer=shm.buf)[:] = x
+        try:
+            pool = Pool(processes, initializer=attach_null_data, 
+                        initargs=(shm.name, x.shape, strata, mem_budget))
+            try:
+                result = pool.map(null_batch, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            shm.close()
+            shm.unlink()
+    
+    if tail == 'upper':
+        extreme = sum(r[0] for r in result)
+    else:
+        extreme = sum(r[1] for r in result)
+    p = (1 + extreme) / (1.0 + n_perm)
+    
+    #adjust over each pair of different codes once
+    (r, c) = np.triu_indices(len(cols), 1)
+    q = np.ones(p.shape)
+    q[r, c] = bh_fdr(p[r, c])
+    q[c, r] = q[r, c]
+    
+    return (pd.DataFrame(p, index=cols, columns=cols), 
+            pd.DataFrame(q, index=cols, columns=cols))
+
+def significant_cooccur(data, alpha=0.05, directed=False, **kwargs):
+    '''z scores from norm_cooccur(), keeping only the pairs of codes 
+    whose permutation test is significant at false discovery rate alpha 
+    (others are 0). Use with make_net() to draw only significant edges.
+    Other arguments are passed to permutation_pvalues().
+    '''
+    z = norm_cooccur(data, directed=directed)
+    (p, q) = permutation_pvalues(data, **kwargs)
+    
+    return z.where(q < alpha, 0)
+
 def reverse(data):
     '''cooccurrance shows affinity between codes, they happen together
     more than we expect. However, the opposite effect is also interesting.
@@ -267,47 +566,462 @@ def reverse(data):
 
 def jaccard(a, b):
     '''Jaccard similarity index for two vectors'''
-    n = len(a)
-    union = 0.0
-    intersection = 0.0
-    #iterate over vector elements
-    for i in range(0, n):
-        #if at least one has a code
-        if a[j] | b[j]:
-            intersection = intersection + 1
-            #if both have the code
-            if a[j] & b[j]:
-                union = union + 1
+    a = np.asarray(a, dtype=bool)
+    b = np.asarray(b, dtype=bool)
+    #codes applied to at least one of them
+    union = np.sum(a | b)
+    #codes applied to both
+    intersection = np.sum(a & b)
     
     result = 0.0
-    if intersection > 0:
-        result = union / intersection
+    if union > 0:
+        result = intersection / (1.0 * union)
     
     return result
 
-def all_v_all_jaccard_sim(df):
-    '''Serial implementation of all v all Jaccard similarity.
-    Slow, space intensive. Reccomended only for small data sets.
-    Used here to compute the edge weights on a network that is the 
-    projection from codes onto people or onto answers.
+def pack_codes(df):
+    '''Pack the code applications of each row (person, answer) into a
+    sparse matrix for fast similarity computations. Also returns the 
+    number of codes applied to each row.
     '''
-    #add a unique ID column
-    n = len(df) + 1
-    idx = range(1, n)
-    df['uid'] = idx
-    id_map = df[['uid']]
-    df = df.set_index(['uid'])
+    x = sparse.csr_matrix(df.values.astype(bool), dtype=np.float32)
+    counts = np.asarray(x.sum(axis=1)).ravel()
+    return (x, counts)
+
+def jaccard_block(x, counts, start, stop, min_weight=0, 
+                  col_start=0, col_stop=None):
+    '''Jaccard similarity of rows start to stop of a packed code 
+    matrix against rows col_start to col_stop (by default, all rows 
+    before stop). Only pairs with a score above min_weight are 
+    returned, as arrays of (i, j, score) with j < i.
+    '''
+    if col_stop is None:
+        col_stop = stop
+    #number of codes shared by each pair, kept sparse since most 
+    #pairs share no codes at all
+    both = x[start:stop].dot(x[col_start:col_stop].T).tocoo()
+    i = both.row + start
+    j = both.col + col_start
+    #keep the lower triangle only
+    lower = j < i
+    i = i[lower]
+    j = j[lower]
+    both = both.data[lower]
     
-    data = df.transpose()
-    result = pd.DataFrame(0, index=idx, columns=idx)
+    #union = codes in either row, counting shared codes once
+    w = both / (counts[i] + counts[j] - both)
+    keep = w > min_weight
+    
+    return (i[keep], j[keep], w[keep])
+
+def tile_size(mem_budget, bytes_per_pair=48):
+    '''Side length of a square tile of pairwise comparisons that fits in
+    mem_budget bytes. bytes_per_pair is the worst case cost of one pair, 
+    which is reached when every pair in the tile shares a code.
+    '''
+    return max(1, int(sqrt(mem_budget / float(bytes_per_pair))))
+
+def jaccard_tiles(x, counts, min_weight=0, mem_budget=2**28, 
+                  start=0, stop=None):
+    '''Generator over the lower triangle of all v all Jaccard similarity 
+    of a packed code matrix, one square tile at a time. Yields arrays of
+    (i, j, score) for each tile, so peak memory is bounded by mem_budget
+    (in bytes) rather than by the number of rows squared. start and stop
+    restrict the rows i to compare against all rows before them.
+    '''
+    if stop is None:
+        stop = x.shape[0]
+    size = tile_size(mem_budget)
     
-    for i in range(1, n):
-        if i % 50 == 0:
-            print((i*100.0)/n, '% of', n, 'done...')
-        for j in range(1, i):
-            result.iloc[i, j] = jaccard(data[i], data[j])
+    for row_start in range(start, stop, size):
+        row_stop = min(row_start + size, stop)
+        #only tiles on or below the diagonal have pairs with j < i
+        for col_start in range(0, row_stop, size):
+            col_stop = min(col_start + size, row_stop)
+            yield jaccard_block(x, counts, row_start, row_stop, min_weight, 
+                                col_start, col_stop)
+
+def jaccard_edges(df, min_weight=0, mem_budget=2**28):
+    '''All v all Jaccard similarity of the rows of df, computed in 
+    tiles with sparse matrix products. Used to compute the edge 
+    weights on a network that is the projection from codes onto people 
+    or onto answers.
+    Input:
+        df: a data frame of code applications, one row per person/answer
+        min_weight: only keep pairs with similarity above this number
+        mem_budget: approximate bytes to use for each tile of comparisons
+    Returns a data frame mapping the index of df to integer ids and an 
+    edge list with columns i, j, Jaccard (where j < i).
+    '''
+    id_map = pd.DataFrame({'uid': range(0, len(df))}, index=df.index)
+    (x, counts) = pack_codes(df)
     
-    return (id_map, result)
+    #start from empty arrays so the edge list has the right types
+    #even when there are no edges
+    i = [np.zeros(0, dtype=int)]
+    j = [np.zeros(0, dtype=int)]
+    w = [np.zeros(0)]
+    for tile in jaccard_tiles(x, counts, min_weight, mem_budget):
+        i.append(tile[0])
+        j.append(tile[1])
+        w.append(tile[2])
+    
+    edges = pd.DataFrame({'i': np.concatenate(i), 'j': np.concatenate(j),
+                          'Jaccard': np.concatenate(w)})
+    
+    return (id_map, edges)
+
+def jaccard_to_file(df, path, min_weight=0, mem_budget=2**28, sep='\t'):
+    '''Out-of-core version of jaccard_edges(). Each tile's edges are 
+    appended to the file at path as soon as they are computed, so memory
+    use does not grow with the number of edges. Paths ending in .feather
+    or .arrow get a compact binary file (int32 ids, float32 weights, one
+    record batch per tile) that dedoose_utils.load_frame() can read; this
+    needs pyarrow. Anything else is written as delimited text. Returns 
+    the id map.
+    '''
+    id_map = pd.DataFrame({'uid': range(0, len(df))}, index=df.index)
+    (x, counts) = pack_codes(df)
+    tiles = jaccard_tiles(x, counts, min_weight, mem_budget)
+    
+    if str(path).endswith(('.feather', '.arrow')):
+        import pyarrow as pa
+        
+        schema = pa.schema([('i', pa.int32()), ('j', pa.int32()), 
+                            ('Jaccard', pa.float32())])
+        #Feather files are Arrow IPC files
+        with pa.OSFile(str(path), 'wb') as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                for (i, j, w) in tiles:
+                    if len(i) == 0:
+                        continue
+                    writer.write_batch(pa.record_batch(
+                        [pa.array(i.astype(np.int32)), 
+                         pa.array(j.astype(np.int32)), 
+                         pa.array(w.astype(np.float32))], schema=schema))
+        return id_map
+    
+    with open(path, 'w') as f:
+        #write the header even if there are no edges
+        pd.DataFrame(columns=['i', 'j', 'Jaccard']).to_csv(f, sep=sep, 
+                                                            index=False)
+        for (i, j, w) in tiles:
+            tile = pd.DataFrame({'i': i, 'j': j, 'Jaccard': w})
+            tile.to_csv(f, sep=sep, index=False, header=False)
+    
+    return id_map
+
+#packed code matrix shared with each worker process by attach_codes()
+worker_codes = {}
+
+def attach_codes(name, shape, n_codes, min_weight, mem_budget):
+    '''Pool initializer for jaccard_edges_parallel(). Unpacks the bit 
+    packed code matrix from shared memory once per worker.
+    '''
+    shm = shared_memory.SharedMemory(name=name)
+    bits = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    x = sparse.csr_matrix(np.unpackbits(bits, axis=1, count=n_codes), 
+                          dtype=np.float32)
+    shm.close()
+    
+    worker_codes['x'] = x
+    worker_codes['counts'] = np.asarray(x.sum(axis=1)).ravel()
+    worker_codes['min_weight'] = min_weight
+    worker_codes['mem_budget'] = mem_budget
+
+def jaccard_chunk(bounds):
+    '''Map function for jaccard_edges_parallel(). Compares rows 
+    start to stop to all rows before them.
+    '''
+    (start, stop) = bounds
+    tiles = list(jaccard_tiles(worker_codes['x'], worker_codes['counts'], 
+                               worker_codes['min_weight'], 
+                               worker_codes['mem_budget'], start, stop))
+    
+    return (np.concatenate([t[0] for t in tiles]), 
+            np.concatenate([t[1] for t in tiles]), 
+            np.concatenate([t[2] for t in tiles]))
+
+def triangle_chunks(n, chunks):
+    '''Split rows 0 to n into ranges with about the same number of 
+    pairs in the lower triangle. Row i has i pairs, so rows up to 
+    n * sqrt(k / chunks) hold k / chunks of all pairs.
+    '''
+    bounds = [int(round(n * sqrt(k / float(chunks)))) 
+              for k in range(0, chunks + 1)]
+    return [(a, b) for (a, b) in zip(bounds[:-1], bounds[1:]) if b > a]
+
+def jaccard_edges_parallel(df, min_weight=0, processes=None, 
+                           mem_budget=2**28, chunks_per_process=4):
+    '''Multi-core version of jaccard_edges() using a local process pool,
+    no cluster required. The code matrix is bit packed into shared memory
+    and unpacked once by each worker, so only row ranges are sent to 
+    workers and only edges are sent back. 
+    Input:
+        processes: number of workers, defaults to the number of cores
+        mem_budget: approximate bytes for each worker's tiles
+        chunks_per_process: more chunks balance load better when some 
+        rows share many more codes than others
+    Returns the same (id_map, edges) as jaccard_edges().
+    '''
+    if processes is None:
+        processes = cpu_count()
+    id_map = pd.DataFrame({'uid': range(0, len(df))}, index=df.index)
+    n_codes = df.shape[1]
+    bits = np.packbits(df.values.astype(bool), axis=1)
+    
+    #share the packed codes with workers once
+    shm = shared_memory.SharedMemory(create=True, size=max(1, bits.nbytes))
+    np.ndarray(bits.shape, dtype=np.uint8, buffer=shm.buf)[:] = bits
+    
+    try:
+        pool = Pool(processes, initializer=attach_codes, 
+                    initargs=(shm.name, bits.shape, n_codes, min_weight, 
+                              mem_budget))
+        chunks = triangle_chunks(len(df), processes * chunks_per_process)
+        try:
+            result = pool.map(jaccard_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shm.close()
+        shm.unlink()
+    
+    #start from empty arrays so the edge list has the right types
+    #even when there are no edges
+    result.append((np.zeros(0, dtype=int), np.zeros(0, dtype=int), 
+                   np.zeros(0)))
+    edges = pd.DataFrame({'i': np.concatenate([r[0] for r in result]), 
+                          'j': np.concatenate([r[1] for r in result]),
+                          'Jaccard': np.concatenate([r[2] for r in result])})
+    
+    return (id_map, edges)
+
+def minhash_signatures(x, num_perm=128, seed=None):
+    '''MinHash signature of the set of codes applied to each row of a 
+    packed code matrix. Two rows agree at any one position of their 
+    signatures with probability equal to their Jaccard similarity.
+    '''
+    rng = np.random.default_rng(seed)
+    prime = 2**31 - 1
+    a = rng.integers(1, prime, num_perm)
+    b = rng.integers(0, prime, num_perm)
+    #hash of each code under each random permutation
+    h = (np.outer(np.arange(x.shape[1]), a) + b) % prime
+    
+    sig = np.full((x.shape[0], num_perm), prime, dtype=np.int64)
+    x = x.tocsc()
+    for c in range(0, x.shape[1]):
+        #the rows with code c applied
+        rows = x.indices[x.indptr[c]:x.indptr[c + 1]]
+        sig[rows] = np.minimum(sig[rows], h[c])
+    
+    return sig
+
+def lsh_candidates(sig, bands=32):
+    '''Locality sensitive hashing of MinHash signatures. Each band of 
+    the signatures puts rows into buckets, and any two rows that share a
+    bucket in any band become a candidate pair. Pairs with Jaccard 
+    similarity above about (1/bands)^(bands/num_perm) are very likely
+    to be found. Returns pairs as arrays of (i, j) with j < i.
+    '''
+    n = sig.shape[0]
+    rows = sig.shape[1] // bands
+    pairs = [np.zeros(0, dtype=np.int64)]
+    
+    for band in range(0, bands):
+        #rows with an identical band of the signature share a bucket
+        (_, bucket) = np.unique(sig[:, band*rows:(band + 1)*rows], axis=0, 
+                                return_inverse=True)
+        bucket = bucket.ravel()
+        order = np.argsort(bucket, kind='stable')
+        #where each bucket starts in sorted order, and its size
+        starts = np.flatnonzero(np.r_[True, np.diff(bucket[order]) != 0])
+        sizes = np.diff(np.r_[starts, n])
+        
+        for (start, size) in zip(starts[sizes > 1], sizes[sizes > 1]):
+            members = order[start:start + size]
+            (p, q) = np.triu_indices(size, 1)
+            i = np.maximum(members[p], members[q])
+            j = np.minimum(members[p], members[q])
+            #one number per pair, so duplicates are easy to drop
+            pairs.append(i * n + j)
+    
+    pairs = np.unique(np.concatenate(pairs))
+    return (pairs // n, pairs % n)
+
+def top_k_edges(edges, k, idx1='i', idx2='j', idx3='Jaccard'):
+    '''Keep only the edges that are among the k heaviest edges of at 
+    least one of the nodes they connect.
+    '''
+    #look at each edge from both of its ends
+    ends = pd.concat([edges[[idx1, idx3]].rename(columns={idx1: 'node'}), 
+                      edges[[idx2, idx3]].rename(columns={idx2: 'node'})])
+    ends = ends.sort_values(by=['node', idx3], ascending=[True, False], 
+                            kind='stable')
+    keep = ends[ends.groupby('node').cumcount() < k].index.unique()
+    
+    return edges.loc[keep]
+
+def minhash_jaccard_edges(df, min_weight=0, k=None, num_perm=128, bands=32, 
+                          seed=None, batch_size=100000):
+    '''Approximate version of jaccard_edges() for very large data sets.
+    Candidate pairs come from MinHash locality sensitive hashing, then 
+    their Jaccard similarity is computed exactly, so there are no false
+    positives, but pairs below the LSH threshold may be missed. Use 
+    jaccard_recall() to check the recall against jaccard_edges().
+    Input:
+        min_weight: only keep pairs with similarity above this number
+        k: if given, only keep each row's k most similar neighbours
+        num_perm: length of the MinHash signatures
+        bands: more bands find more pairs with lower similarity, at the
+        cost of more candidates to check. Must divide num_perm.
+        seed: seed for the random hash functions
+        batch_size: number of candidate pairs verified at a time
+    Returns the same (id_map, edges) as jaccard_edges().
+    '''
+    #a band of 0 rows would put every row in one bucket, and leftover
+    #signature columns would be silently ignored
+    if not (0 < bands <= num_perm and num_perm % bands == 0):
+        raise ValueError('bands must be between 1 and num_perm and divide '
+                         'num_perm, got bands=' + str(bands) + 
+                         ', num_perm=' + str(num_perm))
+    
+    id_map = pd.DataFrame({'uid': range(0, len(df))}, index=df.index)
+    (x, counts) = pack_codes(df)
+    
+    #rows without codes have similarity 0 with everything
+    coded = np.flatnonzero(counts > 0)
+    sig = minhash_signatures(x[coded], num_perm, seed)
+    (i, j) = lsh_candidates(sig, bands)
+    i = coded[i]
+    j = coded[j]
+    
+    #exact similarity of the candidates
+    w = np.zeros(len(i))
+    for start in range(0, len(i), batch_size):
+        b = slice(start, start + batch_size)
+        both = np.asarray(x[i[b]].multiply(x[j[b]]).sum(axis=1)).ravel()
+        w[b] = both / (counts[i[b]] + counts[j[b]] - both)
+    
+    keep = w > min_weight
+    edges = pd.DataFrame({'i': i[keep], 'j': j[keep], 'Jaccard': w[keep]})
+    if k is not None:
+        edges = top_k_edges(edges, k).reset_index(drop=True)
+    
+    return (id_map, edges)
+
+def jaccard_recall(approx, exact, idx1='i', idx2='j'):
+    '''Fraction of the pairs in the exact edge list that were also found
+    in the approximate one.
+    '''
+    if len(exact) == 0:
+        return 1.0
+    found = exact.merge(approx[[idx1, idx2]], on=[idx1, idx2], how='inner')
+    return found.shape[0] / (1.0 * exact.shape[0])
+
+def knn_block(x, counts, start, stop, k, mem_budget=2**28):
+    '''The k most similar rows (by Jaccard similarity) to each of rows 
+    start to stop of a packed code matrix. Columns are compared one tile
+    at a time, and only the best k scores so far are kept for each row.
+    Returns arrays of neighbour ids and scores, both of shape 
+    (stop - start, k), with -1 marking missing neighbours.
+    '''
+    n = x.shape[0]
+    size = tile_size(mem_budget)
+    rows = np.arange(start, stop)
+    best_j = np.full((stop - start, k), -1)
+    best_w = np.full((stop - start, k), -1.0)
+    
+    for col_start in range(0, n, size):
+        col_stop = min(col_start + size, n)
+        cols = np.arange(col_start, col_stop)
+        both = x[start:stop].dot(x[col_start:col_stop].T).toarray()
+        union = counts[rows, np.newaxis] + counts[np.newaxis, cols] - both
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = np.where(union > 0, both / union, 0.0)
+        #a row is not its own neighbour
+        w[rows[:, np.newaxis] == cols[np.newaxis, :]] = -1.0
+        
+        #merge this tile with the best k so far
+        cand_w = np.hstack([best_w, w])
+        cand_j = np.hstack([best_j, np.broadcast_to(cols, w.shape)])
+        top = np.argpartition(-cand_w, k - 1, axis=1)[:, :k]
+        best_w = np.take_along_axis(cand_w, top, axis=1)
+        best_j = np.take_along_axis(cand_j, top, axis=1)
+    
+    return (best_j, best_w)
+
+def jaccard_knn(df, k=10, min_weight=0, mem_budget=2**28, as_sparse=False,
+                mutual=False):
+    '''k nearest neighbour graph of the rows of df by Jaccard similarity.
+    Unlike a thresholded edge list, each node contributes only its k best
+    edges (at most n * k in total), so the graph stays small enough to 
+    lay out and draw at low cutoffs. A popular node can still end up 
+    with more than k edges, unless mutual is set.
+    Input:
+        df: a data frame of code applications, one row per person/answer
+        k: number of neighbours to keep for each row
+        min_weight: ignore neighbours with similarity at or below this
+        mem_budget: approximate bytes to use for each tile of comparisons
+        as_sparse: return a scipy sparse matrix where row i holds the 
+        scores of the neighbours of i, instead of a networkx graph
+        mutual: only keep an edge if each end is among the other's k 
+        nearest neighbours, so no node has more than k edges
+    Returns a data frame mapping the index of df to integer ids and the
+    graph (or matrix), with nodes numbered by those ids.
+    '''
+    id_map = pd.DataFrame({'uid': range(0, len(df))}, index=df.index)
+    (x, counts) = pack_codes(df)
+    n = x.shape[0]
+    k = min(k, max(n - 1, 1))
+    
+    #the best k neighbours only need memory linear in n, so use the
+    #whole budget for the tiles of comparisons
+    size = tile_size(mem_budget)
+    i = []
+    j = []
+    w = []
+    for start in range(0, n, size):
+        stop = min(start + size, n)
+        (best_j, best_w) = knn_block(x, counts, start, stop, k, mem_budget)
+        keep = best_w > min_weight
+        i.append(np.repeat(np.arange(start, stop), k)[keep.ravel()])
+        j.append(best_j[keep])
+        w.append(best_w[keep])
+    
+    i = np.concatenate(i + [np.zeros(0, dtype=int)])
+    j = np.concatenate(j + [np.zeros(0, dtype=int)])
+    w = np.concatenate(w + [np.zeros(0)])
+    
+    if mutual:
+        knn = sparse.csr_matrix((w, (i, j)), shape=(n, n))
+        knn = knn.multiply(knn.T > 0).tocoo()
+        (i, j, w) = (knn.row, knn.col, knn.data)
+    
+    if as_sparse:
+        return (id_map, sparse.csr_matrix((w, (i, j)), shape=(n, n)))
+    
+    g = nx.Graph()
+    g.add_nodes_from(range(0, n))
+    g.add_weighted_edges_from(zip(i.tolist(), j.tolist(), w.tolist()))
+    
+    return (id_map, g)
+
+def all_v_all_jaccard_sim(df):
+    '''All v all Jaccard similarity as a dense lower triangular matrix.
+    Space intensive. Reccomended only for small data sets; use 
+    jaccard_edges() for an edge list instead.
+    '''
+    n = len(df)
+    (id_map, edges) = jaccard_edges(df)
+    
+    result = np.zeros((n, n))
+    result[edges['i'].values, edges['j'].values] = edges['Jaccard'].values
+    
+    return (id_map, pd.DataFrame(result, index=range(0, n), 
+                                 columns=range(0, n)))
 
 def parallel_jaccard(dic):
     '''Map function to be used in parallel computation of 
@@ -322,34 +1036,27 @@ def parallel_jaccard(dic):
     i = dic['i']
     #our data
     data = dic['dat']
-    a = data[i]
-    #the number of codes we're comparing across columns
-    codes = data.shape[0]
+    #the elements to compare against
+    others = data.iloc[:, 0:i].values.astype(bool)
+    a = data[i].values.astype(bool)[:, np.newaxis]
 
-    output = {}
+    #codes applied to both, and to at least one, of each pair
+    intersection = (others & a).sum(axis=0)
+    union = (others | a).sum(axis=0)
     
-    #loop over all the columns we need to compare
-    for k in range(0, i):
-        #temp variables
-        union = 0.0
-        intersection = 0.0
-        b = data[k]
-        #loop over the codes to compare in these cols
-        for j in range(0, codes):
-            #if at least one has a code
-            if a[j] | b[j]:
-                intersection = intersection + 1
-                #if both have the code
-                if a[j] & b[j]:
-                    union = union + 1
-        #only save scores > 0
-        if (intersection > 0) & (union > 0):
-            output[k] = (union / intersection) 
+    #only save scores > 0
+    output = {}
+    for k in np.nonzero(intersection)[0]:
+        output[int(k)] = intersection[k] / (1.0 * union[k])
             
     return {'i':i, 'Jaccard':output}
 
 def list_people_data(df):
-    '''Generates a list of input to be mapped to parallel_jaccard().'''
+    '''Generates a list of input to be mapped to parallel_jaccard().
+    Each job carries a copy of all the data before it, so the total 
+    input grows with n^2; jaccard_edges_parallel() avoids this on a 
+    single machine.
+    '''
     #add a unique ID column
     n = len(df)
     idx = range(0, n)
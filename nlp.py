@@ -5,16 +5,32 @@
 
 import nltk 
 import string
+import pickle
+import shelve
+import hashlib
+import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
+from scipy import sparse
+from functools import lru_cache
+from multiprocessing import Pool, cpu_count
+from sklearn.feature_extraction.text import (TfidfVectorizer, 
+                                             CountVectorizer,
+                                             HashingVectorizer,
+                                             TfidfTransformer,
+                                             ENGLISH_STOP_WORDS)
+from network_utils import tile_size
 
 stemmer = nltk.stem.porter.PorterStemmer()
 remove_punctuation_map = dict((ord(char), None) 
                               for char in string.punctuation)
 
+#most tokens in a corpus are repeats, so memoize the stemmer by 
+#surface form. Each worker process keeps its own cache.
+stem_word = lru_cache(maxsize=2**18)(stemmer.stem)
+
 def stem_tokens(tokens):
     '''word stems'''
-    return [stemmer.stem(item) for item in tokens]
+    return [stem_word(item) for item in tokens]
 
 def normalize(text):
     '''remove punctuation, lowercase, stem'''
@@ -22,30 +38,273 @@ def normalize(text):
     tokens = nltk.word_tokenize(clean)
     return stem_tokens(tokens)
 
+def text_key(text):
+    '''key for a document in the on-disk token cache'''
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def tokenize_all(texts, processes=1, cache=None, chunksize=None):
+    '''normalize() every document in texts. Returns a list with one 
+    list of tokens per document.
+    Input:
+        processes: number of worker processes. None uses all cores. 
+        Scripts using more than 1 must guard their main code with 
+        if __name__ == '__main__'.
+        cache: path of a shelve file of token lists keyed by text hash.
+        Documents found there are not tokenized again, new ones are
+        added. Delete it if normalize() changes.
+        chunksize: documents sent to a worker at a time
+    '''
+    texts = list(texts)
+    tokens = [None] * len(texts)
+    db = None
+    if cache is not None:
+        db = shelve.open(cache)
+    try:
+        keys = []
+        todo = []
+        for (i, text) in enumerate(texts):
+            key = None
+            if db is not None:
+                key = text_key(text)
+                if key in db:
+                    tokens[i] = db[key]
+                    keys.append(key)
+                    continue
+            todo.append(i)
+            keys.append(key)
+        
+        todo_texts = [texts[i] for i in todo]
+        if processes is None:
+            processes = cpu_count()
+        if processes > 1 and len(todo_texts) > 1:
+            if chunksize is None:
+                #a few chunks per process to balance uneven documents
+                chunksize = max(1, len(todo_texts) // (processes * 4))
+            pool = Pool(processes)
+            try:
+                done = pool.map(normalize, todo_texts, chunksize)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            done = [normalize(text) for text in todo_texts]
+        
+        for (i, toks) in zip(todo, done):
+            tokens[i] = toks
+            if db is not None:
+                db[keys[i]] = toks
+    finally:
+        if db is not None:
+            db.close()
+    return tokens
+
+def analyze_tokens(tokens):
+    '''analyzer for vectorizers fed tokenize_all() output. Drops 
+    English stop words, matching tokenizer=normalize with 
+    stop_words='english'.
+    '''
+    return [t for t in tokens if t not in ENGLISH_STOP_WORDS]
+
 vectorizer = TfidfVectorizer(tokenizer=normalize, stop_words='english')
 
-def cosine_sim(texts):
+def cosine_sim(texts, model=None, processes=1, cache=None):
     '''return cosine similarity of an array of documents, such that
     any individual similarity is conditional on not just the two
     vectors being compared, but all other vectors present.
+    Input:
+        model: a fitted SimilarityModel. If given, texts are transformed
+        with its vocabulary and IDF weights instead of refitting them on
+        texts.
+        processes, cache: see tokenize_all()
     '''
-    tfidf = vectorizer.fit_transform(texts)
-    return (tfidf * tfidf.T).A
+    if model is not None:
+        return model.similarity(texts)
+    if processes == 1 and cache is None:
+        tfidf = vectorizer.fit_transform(texts)
+    else:
+        tokens = tokenize_all(texts, processes=processes, cache=cache)
+        tfidf = TfidfVectorizer(analyzer=analyze_tokens).fit_transform(tokens)
+    return (tfidf * tfidf.T).toarray()
 
-def cosine_sim_2(text1, text2):
+def cosine_sim_2(text1, text2, model=None):
     '''return cosine similarity of two documents. Will be higher
-    than the similarity between those documents in cosine_sim_all
+    than the similarity between those documents in cosine_sim
     because that includes more documents in the space.
     '''
-    return cosine_sim_all([text1, text2])[0,1]
+    return cosine_sim([text1, text2], model=model)[0,1]
 
-def cosine_sim_pd(docs, codes):
+def cosine_sim_pd(docs, codes, model=None, processes=1, cache=None):
     '''convert output to pandas dataframe with labels.
     '''
-    cosine_similarities = cosine_sim(docs)
+    cosine_similarities = cosine_sim(docs, model=model, 
+                                     processes=processes, cache=cache)
     return pd.DataFrame(cosine_similarities, columns=codes, 
                       index=codes)
 
+class SimilarityModel(object):
+    '''TF-IDF vocabulary and IDF weights fit once on a corpus and 
+    reused for any number of similarity queries, so repeated runs 
+    (e.g. per subgroup) don't re-tokenize and re-stem the whole corpus.
+    Keyword arguments are passed on to TfidfVectorizer.
+    Input:
+        processes, cache: tokenize with tokenize_all() using these 
+        settings instead of inside the vectorizer
+    '''
+    def __init__(self, texts=None, processes=1, cache=None, **kwargs):
+        self.processes = processes
+        self.cache = cache
+        if self.pretokenized():
+            params = dict(analyzer=analyze_tokens)
+        else:
+            params = dict(tokenizer=normalize, stop_words='english')
+        params.update(kwargs)
+        self.vectorizer = TfidfVectorizer(**params)
+        #tf-idf rows of the fitted corpus
+        self.tfidf = None
+        if texts is not None:
+            self.fit(texts)
+
+    def pretokenized(self):
+        '''whether documents are run through tokenize_all() first'''
+        return self.processes != 1 or self.cache is not None
+
+    def prepare(self, texts):
+        '''documents in the form the vectorizer expects'''
+        if self.pretokenized():
+            return tokenize_all(texts, processes=self.processes, 
+                                cache=self.cache)
+        return texts
+
+    def fit(self, texts):
+        '''learn the vocabulary and IDF weights from texts'''
+        self.tfidf = self.vectorizer.fit_transform(self.prepare(texts))
+        return self
+
+    def transform(self, texts):
+        '''tf-idf rows for new documents, using the fitted vocabulary 
+        and IDF weights. Terms not seen in fit() are ignored.
+        '''
+        return self.vectorizer.transform(self.prepare(texts))
+
+    def similarity(self, texts=None, other=None):
+        '''cosine similarity between the rows of texts and other. 
+        Input:
+            texts: documents to compare. Defaults to the fitted corpus.
+            other: documents to compare against. Defaults to texts.
+        '''
+        if texts is None:
+            a = self.tfidf
+        else:
+            a = self.transform(texts)
+        if other is None:
+            b = a
+        else:
+            b = self.transform(other)
+        return (a * b.T).toarray()
+
+    def similarity_pd(self, codes, texts=None):
+        '''similarity() as a labeled data frame, like cosine_sim_pd()'''
+        return pd.DataFrame(self.similarity(texts), columns=codes, 
+                            index=codes)
+
+    def save(self, path):
+        '''pickle the fitted model to path'''
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        '''load a model written by save()'''
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+def top_k_rows(rows, cols, vals, k):
+    '''keep the k largest values in each row of a sparse matrix given
+    as coordinate arrays'''
+    #sort by row, then by descending value within each row
+    order = np.lexsort((-vals, rows))
+    (rows, cols, vals) = (rows[order], cols[order], vals[order])
+    #position of each entry within its row
+    starts = np.searchsorted(rows, rows, side='left')
+    keep = (np.arange(len(rows)) - starts) < k
+    return (rows[keep], cols[keep], vals[keep])
+
+def cosine_edges(texts, k=None, min_weight=0, mem_budget=2**28, model=None,
+                 processes=1, cache=None):
+    '''Sparse cosine similarity between many documents (e.g. excerpts or
+    people), as an edge list. The tf-idf product is computed one square
+    tile of document pairs at a time, like jaccard_tiles(), and pruned
+    before the next tile, so peak memory is one tile (sized from 
+    mem_budget) plus the edges kept.
+    Input:
+        texts: a list or series of documents. A series index is used as
+        the index of the id map.
+        k: keep only the k most similar documents for each document. 
+        Without k, each pair is listed once, with i > j.
+        min_weight: keep only similarities above this
+        mem_budget: approximate bytes to use for each tile of pairs
+        model: a fitted SimilarityModel to transform texts with. By 
+        default one is fit on texts.
+        processes, cache: see tokenize_all()
+    Returns a data frame mapping documents to integer ids and an edge 
+    list with columns i, j and cosine, e.g. for 
+    make_net_list(edges, idx3='cosine').
+    '''
+    if isinstance(texts, pd.Series):
+        index = texts.index
+    else:
+        index = pd.RangeIndex(len(texts))
+    id_map = pd.DataFrame({'uid': range(0, len(index))}, index=index)
+    
+    if model is None:
+        model = SimilarityModel(texts, processes=processes, cache=cache)
+        tfidf = model.tfidf
+    else:
+        tfidf = model.transform(texts)
+    tfidf = tfidf.tocsr()
+    n = tfidf.shape[0]
+    #tf-idf rows share common terms, so tiles are nearly dense
+    size = tile_size(mem_budget)
+    
+    i = [np.zeros(0, dtype=int)]
+    j = [np.zeros(0, dtype=int)]
+    w = [np.zeros(0)]
+    for start in range(0, n, size):
+        stop = min(start + size, n)
+        #each pair once needs only the columns before these rows
+        if k is None:
+            col_end = stop
+        else:
+            col_end = n
+        #edges kept so far for these rows
+        best = (np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0))
+        for col_start in range(0, col_end, size):
+            col_stop = min(col_start + size, col_end)
+            tile = (tfidf[start:stop] * tfidf[col_start:col_stop].T).tocoo()
+            rows = tile.row + start
+            cols = tile.col + col_start
+            vals = tile.data
+            #a document is not its own neighbour
+            keep = (rows != cols) & (vals > min_weight)
+            if k is None:
+                keep &= rows > cols
+                i.append(rows[keep])
+                j.append(cols[keep])
+                w.append(vals[keep])
+            else:
+                #merge this tile with the best k so far
+                best = top_k_rows(np.concatenate([best[0], rows[keep]]), 
+                                  np.concatenate([best[1], cols[keep]]), 
+                                  np.concatenate([best[2], vals[keep]]), k)
+        if k is not None:
+            i.append(best[0])
+            j.append(best[1])
+            w.append(best[2])
+    
+    edges = pd.DataFrame({'i': np.concatenate(i), 'j': np.concatenate(j),
+                          'cosine': np.concatenate(w)})
+    return (id_map, edges)
+
 def make_docs(df, code_cols, text_col='Excerpt Copy'):
     '''Create documents containing all text from text_col matching 
     each code in code_cols. 
@@ -66,4 +325,99 @@ def make_docs(df, code_cols, text_col='Excerpt Copy'):
     
         documents.append(merged)
         
-    return documents
\ No newline at end of file
+    return documents
+
+def code_term_counts(df, code_cols, text_col='Excerpt Copy', processes=1, 
+                     cache=None):
+    '''Term counts of the document for each code in code_cols, i.e. of
+    make_docs() output, without building those documents. Each excerpt
+    is tokenized once and the code x term matrix is the product of the
+    excerpt x code indicator matrix and the excerpt x term counts.
+    Input:
+        processes, cache: see tokenize_all()
+    Returns a sparse code x term count matrix and the terms.
+    '''
+    indicator = (df[code_cols] == True).to_numpy()
+    #uncoded excerpts are in no document
+    coded = indicator.any(axis=1)
+    indicator = sparse.csr_matrix(indicator[coded].astype(np.int64))
+    texts = df[text_col][coded].fillna('').astype(str)
+    
+    if processes == 1 and cache is None:
+        counter = CountVectorizer(tokenizer=normalize, stop_words='english')
+        counts = counter.fit_transform(texts)
+    else:
+        counter = CountVectorizer(analyzer=analyze_tokens)
+        counts = counter.fit_transform(tokenize_all(texts, 
+                                                    processes=processes,
+                                                    cache=cache))
+    
+    code_counts = (indicator.T * counts).tocsr()
+    terms = counter.get_feature_names_out()
+    return (code_counts, terms)
+
+def code_sim_pd(df, code_cols, text_col='Excerpt Copy', processes=1, 
+                cache=None):
+    '''Same result as cosine_sim_pd(make_docs(df, code_cols, text_col),
+    code_cols), computed from code_term_counts() so each excerpt is 
+    tokenized once no matter how many codes it has.
+    '''
+    (counts, terms) = code_term_counts(df, code_cols, text_col, 
+                                       processes=processes, cache=cache)
+    tfidf = TfidfTransformer().fit_transform(counts)
+    return pd.DataFrame((tfidf * tfidf.T).toarray(), columns=code_cols, 
+                        index=code_cols)
+
+def hashed_code_counts(chunks, code_cols, text_col='Excerpt Copy', 
+                       n_features=2**20, processes=1, cache=None):
+    '''Term counts of the document for each code, like 
+    code_term_counts(), in one pass over chunks of excerpts. Terms are 
+    hashed into n_features columns, so no vocabulary is kept and memory
+    is bounded by len(code_cols) x n_features however large the corpus.
+    Input:
+        chunks: data frames with code_cols and text_col, e.g. from 
+        dedoose_utils.read_excerpts(path, code_cols, [text_col])
+        n_features: number of hash buckets. Distinct terms that share a
+        bucket are counted together.
+        processes, cache: see tokenize_all()
+    Returns a sparse code x bucket count matrix.
+    '''
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+    pretokenized = processes != 1 or cache is not None
+    if pretokenized:
+        hasher = HashingVectorizer(analyzer=analyze_tokens, 
+                                   n_features=n_features,
+                                   alternate_sign=False, norm=None)
+    else:
+        hasher = HashingVectorizer(tokenizer=normalize, stop_words='english',
+                                   n_features=n_features, 
+                                   alternate_sign=False, norm=None)
+    
+    code_counts = sparse.csr_matrix((len(code_cols), n_features))
+    for chunk in chunks:
+        indicator = (chunk[code_cols] == True).to_numpy()
+        coded = indicator.any(axis=1)
+        indicator = sparse.csr_matrix(indicator[coded].astype(np.float64))
+        texts = chunk[text_col][coded].fillna('').astype(str)
+        if pretokenized:
+            texts = tokenize_all(texts, processes=processes, cache=cache)
+        code_counts = code_counts + indicator.T * hasher.transform(texts)
+    
+    return code_counts.tocsr()
+
+def stream_code_sim_pd(chunks, code_cols, text_col='Excerpt Copy', 
+                       n_features=2**20, processes=1, cache=None):
+    '''Code x code cosine similarity from a corpus too large to hold in
+    memory, streamed as chunks of excerpts (see hashed_code_counts()). 
+    IDF weights are applied to the accumulated counts afterwards. Unless 
+    terms collide in the hash, this is the same frame as 
+    cosine_sim_pd(make_docs(df, code_cols, text_col), code_cols) on the 
+    whole corpus.
+    '''
+    counts = hashed_code_counts(chunks, code_cols, text_col, 
+                                n_features=n_features, 
+                                processes=processes, cache=cache)
+    tfidf = TfidfTransformer().fit_transform(counts)
+    return pd.DataFrame((tfidf * tfidf.T).toarray(), columns=code_cols, 
+                        index=code_cols)